@@ -0,0 +1,37 @@
+"""unique index on UsersGeo.user_id
+
+Revision ID: 3f1c2a9d7b10
+Revises: 
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "3f1c2a9d7b10"
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # На чистой БД таблицы создаёт Base.metadata.create_all при старте приложения
+    if not sa.inspect(op.get_bind()).has_table("UsersGeo"):
+        return
+    # Оставляем по одной (последней) записи на пользователя
+    op.execute(
+        """
+        DELETE FROM "UsersGeo" a
+        USING "UsersGeo" b
+        WHERE a.user_id = b.user_id AND a.id < b.id
+        """
+    )
+    op.create_index("ix_UsersGeo_user_id", "UsersGeo", ["user_id"], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_index("ix_UsersGeo_user_id", table_name="UsersGeo")
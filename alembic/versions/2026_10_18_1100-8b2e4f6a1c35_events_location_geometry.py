@@ -0,0 +1,50 @@
+"""events.location geometry column with GIST index
+
+Revision ID: 8b2e4f6a1c35
+Revises: 3f1c2a9d7b10
+Create Date: 2026-10-18 11:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from geoalchemy2 import Geometry
+
+
+# revision identifiers, used by Alembic.
+revision: str = "8b2e4f6a1c35"
+down_revision: Union[str, None] = "3f1c2a9d7b10"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    if not sa.inspect(op.get_bind()).has_table("events"):
+        return
+    op.add_column(
+        "events",
+        sa.Column(
+            "location",
+            Geometry(geometry_type="POINT", srid=4326, spatial_index=False),
+            nullable=True,
+        ),
+    )
+    op.execute(
+        """
+        UPDATE events
+        SET location = ST_SetSRID(ST_MakePoint(longitude, latitude), 4326)
+        WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+        """
+    )
+    op.create_index(
+        "idx_events_location",
+        "events",
+        ["location"],
+        postgresql_using="gist",
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("idx_events_location", table_name="events")
+    op.drop_column("events", "location")
@@ -0,0 +1,66 @@
+"""partitioned UsersGeoHistory table
+
+Revision ID: c47d1e9a2b58
+Revises: 8b2e4f6a1c35
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from geoalchemy2 import Geometry
+
+
+# revision identifiers, used by Alembic.
+revision: str = "c47d1e9a2b58"
+down_revision: Union[str, None] = "8b2e4f6a1c35"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # На чистой БД таблицы создаёт Base.metadata.create_all при старте приложения.
+    # Секции по дням создаются приложением (crud.maintain_history_partitions)
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table("UsersGeo") or inspector.has_table("UsersGeoHistory"):
+        return
+    op.create_table(
+        "UsersGeoHistory",
+        sa.Column("id", sa.BigInteger(), autoincrement=True, nullable=False),
+        sa.Column("recorded_at", sa.DateTime(), nullable=False),
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("latitude", sa.Float(), nullable=False),
+        sa.Column("longitude", sa.Float(), nullable=False),
+        sa.Column(
+            "location",
+            Geometry(geometry_type="POINT", srid=4326, spatial_index=False),
+            sa.Computed(
+                "ST_SetSRID(ST_MakePoint(longitude, latitude), 4326)", persisted=True
+            ),
+            nullable=False,
+        ),
+        sa.PrimaryKeyConstraint("id", "recorded_at"),
+        postgresql_partition_by="RANGE (recorded_at)",
+    )
+    op.create_index(
+        "ix_UsersGeoHistory_user_id_recorded_at",
+        "UsersGeoHistory",
+        ["user_id", "recorded_at"],
+    )
+    op.create_index(
+        "ix_UsersGeoHistory_recorded_at_brin",
+        "UsersGeoHistory",
+        ["recorded_at"],
+        postgresql_using="brin",
+    )
+    op.create_index(
+        "idx_UsersGeoHistory_location",
+        "UsersGeoHistory",
+        ["location"],
+        postgresql_using="gist",
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("UsersGeoHistory")
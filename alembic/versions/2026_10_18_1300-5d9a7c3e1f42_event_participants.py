@@ -0,0 +1,103 @@
+"""event_participants table instead of events.participants JSON
+
+Revision ID: 5d9a7c3e1f42
+Revises: c47d1e9a2b58
+Create Date: 2026-10-18 13:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "5d9a7c3e1f42"
+down_revision: Union[str, None] = "c47d1e9a2b58"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # На чистой БД таблицы создаёт Base.metadata.create_all при старте приложения;
+    # event_participants мог появиться так же, поэтому проверяем каждый шаг
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table("events"):
+        return
+    if not inspector.has_table("event_participants"):
+        op.create_table(
+            "event_participants",
+            sa.Column("id", sa.Integer(), nullable=False),
+            sa.Column("event_id", sa.Integer(), nullable=False),
+            sa.Column("user_id", sa.Integer(), nullable=False),
+            sa.Column("joined_at", sa.DateTime(), nullable=False),
+            sa.ForeignKeyConstraint(["event_id"], ["events.id"], ondelete="CASCADE"),
+            sa.PrimaryKeyConstraint("id"),
+            sa.UniqueConstraint(
+                "event_id", "user_id", name="uq_event_participants_event_id_user_id"
+            ),
+        )
+        op.create_index(
+            "ix_event_participants_user_id", "event_participants", ["user_id"]
+        )
+
+    columns = {column["name"] for column in inspector.get_columns("events")}
+    if "participants_count" not in columns:
+        op.add_column(
+            "events",
+            sa.Column(
+                "participants_count",
+                sa.Integer(),
+                server_default="0",
+                nullable=False,
+            ),
+        )
+    if "participants" not in columns:
+        return
+
+    # В JSON встречаются и id, и объекты пользователей: старый get_event
+    # подменял список данными из сервиса, а PATCH сохранял это в БД
+    op.execute(
+        """
+        INSERT INTO event_participants (event_id, user_id, joined_at)
+        SELECT e.id, p.user_id, e.updated_at
+        FROM events e
+        CROSS JOIN LATERAL (
+            SELECT CASE json_typeof(value)
+                       WHEN 'object' THEN (value->>'id')::int
+                       ELSE (value#>>'{}')::int
+                   END AS user_id
+            FROM json_array_elements(e.participants)
+        ) p
+        WHERE json_typeof(e.participants) = 'array' AND p.user_id IS NOT NULL
+        ON CONFLICT (event_id, user_id) DO NOTHING
+        """
+    )
+    op.execute(
+        """
+        UPDATE events e
+        SET participants_count = (
+            SELECT count(*) FROM event_participants p WHERE p.event_id = e.id
+        )
+        """
+    )
+    op.drop_column("events", "participants")
+
+
+def downgrade() -> None:
+    op.add_column("events", sa.Column("participants", sa.JSON(), nullable=True))
+    op.execute(
+        """
+        UPDATE events e
+        SET participants = p.ids
+        FROM (
+            SELECT event_id, json_agg(user_id ORDER BY joined_at) AS ids
+            FROM event_participants
+            GROUP BY event_id
+        ) p
+        WHERE p.event_id = e.id
+        """
+    )
+    op.drop_column("events", "participants_count")
+    op.drop_index("ix_event_participants_user_id", table_name="event_participants")
+    op.drop_table("event_participants")
@@ -0,0 +1,37 @@
+"""GIST index on UsersGeo.location::geography for metric KNN search
+
+Revision ID: 9e4b6d2f8a17
+Revises: 5d9a7c3e1f42
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "9e4b6d2f8a17"
+down_revision: Union[str, None] = "5d9a7c3e1f42"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # На чистой БД таблицы создаёт Base.metadata.create_all при старте приложения
+    if not sa.inspect(op.get_bind()).has_table("UsersGeo"):
+        return
+    # Уникальный ix_UsersGeo_user_id создан в 3f1c2a9d7b10
+    op.execute(
+        'CREATE INDEX IF NOT EXISTS "idx_UsersGeo_location" '
+        'ON "UsersGeo" USING gist (location)'
+    )
+    op.execute(
+        'CREATE INDEX IF NOT EXISTS "idx_UsersGeo_location_geography" '
+        'ON "UsersGeo" USING gist ((location::geography))'
+    )
+
+
+def downgrade() -> None:
+    op.execute('DROP INDEX IF EXISTS "idx_UsersGeo_location_geography"')
@@ -0,0 +1,44 @@
+"""event_tombstones table and events.updated_at index for incremental change sync
+
+Revision ID: 2a7f5c9e3d61
+Revises: 9e4b6d2f8a17
+Create Date: 2026-10-18 15:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "2a7f5c9e3d61"
+down_revision: Union[str, None] = "9e4b6d2f8a17"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # На чистой БД таблицы создаёт Base.metadata.create_all при старте приложения
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table("events"):
+        return
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS ix_events_updated_at ON events (updated_at)"
+    )
+    if not inspector.has_table("event_tombstones"):
+        op.create_table(
+            "event_tombstones",
+            sa.Column("id", sa.Integer(), nullable=False),
+            sa.Column("event_id", sa.Integer(), nullable=False),
+            sa.Column("deleted_at", sa.DateTime(), nullable=False),
+            sa.PrimaryKeyConstraint("id"),
+        )
+        op.create_index(
+            "ix_event_tombstones_deleted_at", "event_tombstones", ["deleted_at"]
+        )
+
+
+def downgrade() -> None:
+    op.execute("DROP TABLE IF EXISTS event_tombstones")
+    op.execute("DROP INDEX IF EXISTS ix_events_updated_at")
@@ -1,3 +1,3 @@
-from .auth import decode_access_token
+from .auth import decode_access_token, get_current_user_id
 
-__all__ = ("decode_access_token",)
+__all__ = ("decode_access_token", "get_current_user_id")
@@ -1,23 +1,52 @@
-from datetime import datetime
 import time
 import jwt
+from fastapi import HTTPException, status
 
+from core.cache import TTLCache
 from core.config import settings
 
+# Проверенные токены: token -> (user_id, exp). Срок жизни записи дополнительно
+# ограничен exp самого токена
+verified_tokens = TTLCache(
+    maxsize=settings.auth_jwt.token_cache_size,
+    ttl=settings.auth_jwt.token_cache_ttl,
+)
+
 
 def decode_access_token(
     token: str,
     algorithm: str = settings.auth_jwt.algorithm,
     secret: str = settings.auth_jwt.secret_key,
 ) -> str:
+    use_cache = (
+        algorithm == settings.auth_jwt.algorithm
+        and secret == settings.auth_jwt.secret_key
+    )
+    if use_cache:
+        cached = verified_tokens.get(token)
+        if cached is not None:
+            user_id, exp = cached
+            if exp >= time.time():
+                return user_id
+            verified_tokens.invalidate(token)
+            raise ValueError("Token has expired")
     try:
         payload = jwt.decode(token, secret, algorithms=[algorithm])
-        user_id: str = payload.get("sub")
-        exp = payload.get("exp")
-        if exp < time.mktime(datetime.now().timetuple()):
-            raise ValueError("Token has expired")
-        if user_id is None:
-            raise ValueError("User ID not found in token")
-        return user_id
     except jwt.PyJWTError:
         raise ValueError("Token is invalid or has expired")
+    user_id: str = payload.get("sub")
+    exp = payload.get("exp")
+    if exp is None or exp < time.time():
+        raise ValueError("Token has expired")
+    if user_id is None:
+        raise ValueError("User ID not found in token")
+    if use_cache:
+        verified_tokens.set(token, (user_id, exp))
+    return user_id
+
+
+def get_current_user_id(token: str) -> int:
+    try:
+        return int(decode_access_token(token=token))
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=str(e))
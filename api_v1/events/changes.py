@@ -0,0 +1,60 @@
+from datetime import datetime
+from typing import Protocol
+
+
+class EventListener(Protocol):
+    def event_changed(self, event: dict, previous: tuple[float, float] | None): ...
+
+    def event_removed(self, event_id: int, previous: tuple[float, float] | None): ...
+
+
+class EventChanges:
+    """Рассылка изменений событий слушателям внутри процесса (геозоны,
+    подписки на область карты).
+
+    crud сообщает о своих изменениях сразу; изменения, сделанные другими
+    воркерами, находит периодическая инкрементальная сверка с БД по
+    updated_at и отметкам об удалении. Сверка перечитывает строки из окна
+    перекрытия, поэтому повторно пришедшая версия события не рассылается.
+    event — словарь схемы Event с полем updated_at; previous — прежняя точка
+    события, чтобы слушатели нашли тех, кого касалось старое положение.
+    """
+
+    def __init__(self):
+        self.listeners: list[EventListener] = []
+        self.points: dict[int, tuple[float, float]] = {}
+        # Версии, разосланные в пределах окна перекрытия сверки
+        self.recent: dict[int, datetime] = {}
+
+    def subscribe(self, listener: EventListener) -> None:
+        self.listeners.append(listener)
+
+    def changed(self, event: dict) -> None:
+        event_id = event["id"]
+        if self.recent.get(event_id) == event["updated_at"]:
+            return
+        self.recent[event_id] = event["updated_at"]
+        previous = self.points.get(event_id)
+        self.points[event_id] = (event["latitude"], event["longitude"])
+        for listener in self.listeners:
+            listener.event_changed(event, previous)
+
+    def removed(self, event_id: int) -> None:
+        self.recent.pop(event_id, None)
+        if event_id not in self.points:
+            # Уже удалено этим воркером или не дошло до него вовсе
+            return
+        previous = self.points.pop(event_id)
+        for listener in self.listeners:
+            listener.event_removed(event_id, previous)
+
+    def forget_before(self, moment: datetime) -> None:
+        """Версии старше окна перекрытия сверка больше не перечитает."""
+        self.recent = {
+            event_id: updated_at
+            for event_id, updated_at in self.recent.items()
+            if updated_at >= moment
+        }
+
+
+event_changes = EventChanges()
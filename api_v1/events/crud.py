@@ -1,64 +1,128 @@
-from datetime import datetime
+import asyncio
+import logging
+import os
+import tempfile
+from datetime import datetime, timedelta
 from pathlib import Path
+from typing import AsyncIterator, BinaryIO
 
-import httpx
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.engine import Result
 from fastapi import HTTPException, status, UploadFile
-from sqlalchemy.orm.attributes import flag_modified
-
-from api_v1.events.schemas import EventCreate, EventUpdate, EventsInArea
-from core.models import Event
-from sqlalchemy import select
-
-UPLOAD_DIR = Path(__file__).resolve().parent.parent.parent / "uploads/avatars"
-UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
-
-
-async def get_events(session: AsyncSession) -> list[Event]:
+from sqlalchemy.dialects.postgresql import aggregate_order_by, array_agg, insert
+from sqlalchemy.exc import IntegrityError
+
+from api_v1.events.schemas import (
+    Area,
+    Event as EventSchema,
+    EventCreate,
+    EventDetail,
+    EventUpdate,
+    EventsInArea,
+    EventsClustersInArea,
+)
+from api_v1.events.changes import event_changes
+from api_v1.events.previews import UPLOAD_DIR, preview_filenames, preview_pipeline
+from core.cache import _MISSING
+from core.config import settings
+from core.models import Event, EventParticipant, EventTombstone, db_helper
+from core.profiles import profile_resolver
+from core.users_service import UsersServiceClient
+from sqlalchemy import delete, select, func, update
+
+logger = logging.getLogger(__name__)
+
+
+def event_location(latitude: float, longitude: float) -> str:
+    return f"SRID=4326;POINT({longitude} {latitude})"
+
+
+async def get_events(
+    session: AsyncSession,
+    after_id: int | None = None,
+    limit: int = 100,
+) -> list[Event]:
     stmt = select(Event).order_by(Event.id)
+    if after_id is not None:
+        stmt = stmt.filter(Event.id > after_id)
+    stmt = stmt.limit(limit)
     result: Result = await session.execute(stmt)
     events = result.scalars().all()
     return list(events)
 
 
+async def stream_events(after_id: int | None = None) -> AsyncIterator[list[Event]]:
+    """Отдаёт всю таблицу пачками по stream_chunk_size строк через серверный курсор.
+    Сессия своя: ответ стримится уже после закрытия сессии из зависимости."""
+    stmt = select(Event).order_by(Event.id)
+    if after_id is not None:
+        stmt = stmt.filter(Event.id > after_id)
+    stmt = stmt.execution_options(yield_per=settings.events.stream_chunk_size)
+    async with db_helper.session_factory() as session:
+        result = await session.stream_scalars(stmt)
+        async for events in result.partitions():
+            yield events
+
+
 async def get_event(
     session: AsyncSession,
     event_id: int,
-    user_service_url: str,
+    users_client: UsersServiceClient,
     token: str,
-) -> Event | None:
+) -> EventDetail | None:
     event = await session.get(Event, event_id)
-
-    participant_ids = event.participants if event.participants else []
-    print("participant_ids ", participant_ids)
+    if event is None:
+        return None
+    detail = EventDetail.model_validate(event)
+
+    participant_ids = await get_participant_ids(
+        session=session,
+        event_id=event_id,
+        limit=settings.events.participants_preview_limit,
+    )
     if participant_ids:
-        headers = {"Authorization": f"Bearer {token}"}
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{user_service_url}/auth/getUsersByIds",
-                headers=headers,
-                json={"ids": participant_ids},
-            )
-            if response.status_code == 200:
-                users_data = response.json()
+        detail.participants = await profile_resolver.resolve(
+            participant_ids, token=token, users_client=users_client
+        )
 
-                # Обновляем участников в event, предполагая, что users_data - это список данных о пользователях
-                event.participants = users_data  # Обновляем участников
+    return detail
 
-            else:
-                raise HTTPException(
-                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                    detail="Failed to fetch users data from the microservice",
-                )
 
-    return event
+async def get_participant_ids(
+    session: AsyncSession,
+    event_id: int,
+    limit: int,
+    after_id: int | None = None,
+) -> list[int]:
+    participants = await get_participants(
+        session=session, event_id=event_id, limit=limit, after_id=after_id
+    )
+    return [participant.user_id for participant in participants]
+
+
+async def get_participants(
+    session: AsyncSession,
+    event_id: int,
+    limit: int = 100,
+    after_id: int | None = None,
+) -> list[EventParticipant]:
+    # Keyset-пагинация по user_id: идёт по уникальному индексу (event_id, user_id)
+    stmt = select(EventParticipant).filter(EventParticipant.event_id == event_id)
+    if after_id is not None:
+        stmt = stmt.filter(EventParticipant.user_id > after_id)
+    stmt = stmt.order_by(EventParticipant.user_id).limit(limit)
+    result: Result = await session.execute(stmt)
+    return list(result.scalars().all())
 
 
 async def create_event(session: AsyncSession, event_in: EventCreate) -> Event:
-    event = Event(**event_in.model_dump())
+    event = Event(
+        **event_in.model_dump(),
+        location=event_location(event_in.latitude, event_in.longitude),
+    )
     session.add(event)
     await session.commit()
+    event_changes.changed(event_payload(event))
     return event
 
 
@@ -67,9 +131,17 @@ async def update_event(
     event: Event,
     event_update: EventUpdate,
 ) -> Event:
-    for name, value in event_update.model_dump(exclude_unset=True).items():
+    event_data = event_update.model_dump(exclude_unset=True)
+    for name, value in event_data.items():
         setattr(event, name, value)
+    if "latitude" in event_data or "longitude" in event_data:
+        event.location = event_location(event.latitude, event.longitude)
+    # По updated_at другие воркеры узнают об изменении
+    event.updated_at = datetime.now()
     await session.commit()
+    event_changes.changed(event_payload(event))
+    # location отложенная колонка и не должна попадать в ответ
+    session.expire(event, ["location"])
     return event
 
 
@@ -78,57 +150,257 @@ async def delete_event(
     event: Event,
 ) -> None:
     await session.delete(event)
+    # Другие воркеры узнают об удалении из отметки при следующей сверке
+    session.add(EventTombstone(event_id=event.id))
     await session.commit()
+    event_changes.removed(event.id)
+    preview_filenames.invalidate(event.id)
+    await remove_preview_file(event.preview_picture)
+
+
+def event_payload(event: Event) -> dict:
+    return {
+        **EventSchema.model_validate(event).model_dump(),
+        "updated_at": event.updated_at,
+    }
+
+
+async def sync_event_changes(
+    session: AsyncSession,
+    since: datetime | None = None,
+) -> datetime | None:
+    """Передаёт слушателям event_changes события, изменённые или удалённые
+    после since (без since — все события). Строки за последние
+    changes_sync_overlap секунд перечитываются: транзакция с более ранним
+    updated_at могла закоммититься уже после прошлой сверки.
+    Возвращает метку для следующей сверки."""
+    overlap = timedelta(seconds=settings.events.changes_sync_overlap)
+    window_start = since - overlap if since is not None else None
+
+    stmt = select(Event)
+    if window_start is not None:
+        stmt = stmt.where(Event.updated_at > window_start)
+    result = await session.stream_scalars(
+        stmt.execution_options(yield_per=settings.events.stream_chunk_size)
+    )
+    async for event in result:
+        event_changes.changed(event_payload(event))
+        if event.updated_at is not None and (since is None or event.updated_at > since):
+            since = event.updated_at
+
+    if window_start is not None:
+        result = await session.execute(
+            select(EventTombstone.event_id, EventTombstone.deleted_at).where(
+                EventTombstone.deleted_at > window_start
+            )
+        )
+        for event_id, deleted_at in result:
+            event_changes.removed(event_id)
+            if deleted_at > since:
+                since = deleted_at
+
+    await session.execute(
+        delete(EventTombstone).where(
+            EventTombstone.deleted_at
+            < datetime.now() - timedelta(seconds=settings.events.tombstone_ttl)
+        )
+    )
+    await session.commit()
+    if since is not None:
+        event_changes.forget_before(since - overlap)
+    return since
+
+
+async def run_event_changes_sync(since: datetime | None = None) -> None:
+    while True:
+        await asyncio.sleep(settings.events.changes_sync_interval)
+        try:
+            async with db_helper.session_factory() as session:
+                since = await sync_event_changes(session=session, since=since)
+        except Exception:
+            logger.exception("Failed to sync event changes")
+
+
+def area_envelope(area: Area):
+    return func.ST_MakeEnvelope(
+        area.min_longitude,
+        area.min_latitude,
+        area.max_longitude,
+        area.max_latitude,
+        4326,
+    )
 
 
 async def events_in_area(
     session: AsyncSession,
     area: EventsInArea,
 ) -> list[Event]:
-    stmt = select(Event).filter(
-        Event.latitude >= area.min_latitude,
-        Event.latitude <= area.max_latitude,
-        Event.longitude >= area.min_longitude,
-        Event.longitude <= area.max_longitude,
-    )
+    stmt = select(Event).filter(Event.location.op("&&")(area_envelope(area)))
+    if area.after_id is not None:
+        stmt = stmt.filter(Event.id > area.after_id)
+    stmt = stmt.order_by(Event.id).limit(area.limit)
     result: Result = await session.execute(stmt)
     events = result.scalars().all()
     return list(events)
 
 
+async def event_clusters_in_area(
+    session: AsyncSession,
+    area: EventsClustersInArea,
+) -> list[dict]:
+    # Сетка в градусах: тайл 256px на зуме z покрывает 360 / 2^z градусов долготы
+    cell_size = 360 / 2**area.zoom * settings.events.cluster_cell_px / 256
+    sample_size = settings.events.cluster_sample_size
+    cell = func.ST_SnapToGrid(Event.location, cell_size)
+    # Номер события внутри ячейки: в выборку попадают только первые
+    # sample_size id, а не массив всех событий кластера
+    events = (
+        select(
+            Event.id,
+            Event.location,
+            cell.label("cell"),
+            func.row_number()
+            .over(partition_by=cell, order_by=Event.id)
+            .label("position"),
+        )
+        .filter(Event.location.op("&&")(area_envelope(area)))
+        .subquery()
+    )
+    event_ids = array_agg(aggregate_order_by(events.c.id, events.c.id)).filter(
+        events.c.position <= sample_size
+    )
+    stmt = (
+        select(
+            func.count().label("count"),
+            func.avg(func.ST_Y(events.c.location)).label("latitude"),
+            func.avg(func.ST_X(events.c.location)).label("longitude"),
+            event_ids.label("event_ids"),
+        )
+        .group_by(events.c.cell)
+        .order_by(func.count().desc())
+        .limit(settings.events.max_clusters)
+    )
+    result: Result = await session.execute(stmt)
+    return [
+        {
+            "latitude": row.latitude,
+            "longitude": row.longitude,
+            "count": row.count,
+            "event_ids": row.event_ids,
+        }
+        for row in result
+    ]
+
+
 async def add_participant_to_event(
     event_id: int,
     user_id: int,
     session: AsyncSession,
 ) -> Event:
-    # Получаем ивент по ID
-    stmt = select(Event).filter(Event.id == event_id)
-    result = await session.execute(stmt)
-    event = result.scalar_one_or_none()
-
-    if not event:
+    # Уникальный ключ (event_id, user_id) отсекает повторное и конкурентное вступление
+    stmt = (
+        insert(EventParticipant)
+        .values(event_id=event_id, user_id=user_id, joined_at=datetime.now())
+        .on_conflict_do_nothing(index_elements=["event_id", "user_id"])
+        .returning(EventParticipant.id)
+    )
+    try:
+        inserted = (await session.execute(stmt)).scalar_one_or_none()
+    except IntegrityError:
+        # Нарушен внешний ключ: события нет
+        await session.rollback()
         raise HTTPException(status_code=404, detail="Event not found")
-
-    # Если participants не существует, создаем пустой список
-    if not event.participants:
-        event.participants = []
-
-    # Добавляем user_id в список участников, если его нет
-    if user_id not in event.participants:
-        event.participants.append(user_id)
-        flag_modified(event, "participants")
-    else:
+    if inserted is None:
+        await session.rollback()
         raise HTTPException(status_code=400, detail="User is already a participant")
 
-    # Обновляем время изменения события
-    event.updated_at = datetime.now()
-    session.add(event)
-    # Сохраняем изменения в базе данных
+    # Счётчик увеличивается атомарно в той же транзакции, что и вставка
+    stmt = (
+        update(Event)
+        .where(Event.id == event_id)
+        .values(
+            participants_count=Event.participants_count + 1,
+            updated_at=datetime.now(),
+        )
+        .returning(Event)
+    )
+    event = (await session.execute(stmt)).scalar_one()
     await session.commit()
 
     return event
 
 
+# Сигнатуры начала файла: тип определяем по содержимому, а не по имени файла
+IMAGE_SIGNATURES = {
+    b"\xff\xd8\xff": ("image/jpeg", "jpg"),
+    b"\x89PNG\r\n\x1a\n": ("image/png", "png"),
+    b"GIF87a": ("image/gif", "gif"),
+    b"GIF89a": ("image/gif", "gif"),
+}
+
+
+def sniff_image(head: bytes) -> tuple[str, str] | None:
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp", "webp"
+    for signature, image_type in IMAGE_SIGNATURES.items():
+        if head.startswith(signature):
+            return image_type
+    return None
+
+
+async def remove_preview_file(filename: str | None) -> None:
+    if filename:
+        await preview_pipeline.remove(filename)
+
+
+def open_upload_file() -> tuple[Path, BinaryIO]:
+    # Временный файл в том же каталоге, чтобы os.replace был атомарным
+    fd, temp_name = tempfile.mkstemp(dir=UPLOAD_DIR, prefix=".upload-", suffix=".part")
+    return Path(temp_name), os.fdopen(fd, "wb")
+
+
+async def stream_upload(file: UploadFile) -> tuple[Path, str]:
+    """Пишет загрузку во временный файл кусками по chunk_size через пул
+    потоков, проверяя размер и тип по ходу. Возвращает путь к файлу и
+    расширение по содержимому; при ошибке файл удаляется."""
+    config = settings.uploads
+    if file.content_type not in config.allowed_content_types:
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail="Unsupported file type",
+        )
+    extension = None
+    size = 0
+    path, buffer = await asyncio.to_thread(open_upload_file)
+    try:
+        try:
+            while chunk := await file.read(config.chunk_size):
+                if extension is None:
+                    image_type = sniff_image(chunk)
+                    allowed = config.allowed_content_types
+                    if image_type is None or image_type[0] not in allowed:
+                        raise HTTPException(
+                            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+                            detail="Unsupported file type",
+                        )
+                    extension = image_type[1]
+                size += len(chunk)
+                if size > config.max_size:
+                    raise HTTPException(
+                        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                        detail="File is too large",
+                    )
+                await asyncio.to_thread(buffer.write, chunk)
+        finally:
+            await asyncio.to_thread(buffer.close)
+        if extension is None:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Empty file")
+    except BaseException:
+        await asyncio.to_thread(path.unlink, missing_ok=True)
+        raise
+    return path, extension
+
+
 async def save_image(
     session: AsyncSession,
     file: UploadFile,
@@ -147,38 +419,71 @@ async def save_image(
             status_code=status.HTTP_403_FORBIDDEN, detail="You cant modify this event"
         )
 
-    extension = file.filename.split(".")[-1]
-    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-    filename = f"{event.id}_event_preview_{timestamp}.{extension}"
-    file_location = UPLOAD_DIR / filename
-
+    temp_path = None
     try:
-        with open(file_location, "wb") as buffer:
-            buffer.write(await file.read())
+        temp_path, extension = await stream_upload(file)
+        timestamp = datetime.now().strftime("%Y%m%d%H%M%S%f")
+        filename = f"{event.id}_event_preview_{timestamp}.{extension}"
+        await asyncio.to_thread(os.replace, temp_path, UPLOAD_DIR / filename)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Could not save file: {str(e)}")
+    finally:
+        if temp_path is not None:
+            await asyncio.to_thread(temp_path.unlink, missing_ok=True)
+
+    previous = event.preview_picture
     event.preview_picture = filename
     try:
         await session.commit()
     except Exception as e:
+        await remove_preview_file(filename)
         raise HTTPException(status_code=500, detail=f"Could not update event: {str(e)}")
+    preview_filenames.set(event.id, filename)
+    if previous != filename:
+        await remove_preview_file(previous)
+    preview_pipeline.submit(filename)
 
     return event
 
 
+async def get_preview_filename(
+    event_id: int,
+    session: AsyncSession,
+) -> str | None:
+    filename = preview_filenames.get(event_id, _MISSING)
+    if filename is not _MISSING:
+        return filename
+    stmt = select(Event.preview_picture).filter(Event.id == event_id)
+    result: Result = await session.execute(stmt)
+    row = result.first()
+    if row is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Could not find event"
+        )
+    preview_filenames.set(event_id, row.preview_picture)
+    return row.preview_picture
+
+
 async def get_event_preview(
     event_id: int,
     session: AsyncSession,
+    size: str | None = None,
 ) -> Path:
-    stmt = select(Event).filter(Event.id == event_id)
-    result = await session.execute(stmt)
-    event = result.scalars().first()
-    if event:
-        if event.preview_picture:
-            return UPLOAD_DIR / event.preview_picture
+    if size is not None and size not in settings.previews.variants:
         raise HTTPException(
-            status_code=status.HTTP_406_NOT_ACCEPTABLE, detail="Event has no avatar"
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Unknown preview size"
         )
+    # Повторные запросы обслуживаются из кэша имён без обращения к БД
+    filename = await get_preview_filename(event_id=event_id, session=session)
+    if filename:
+        if size is not None:
+            variant = preview_pipeline.variant_path(filename, size)
+            # Пока варианты нарезаются, отдаём исходный файл
+            if await asyncio.to_thread(variant.exists):
+                return variant
+        return UPLOAD_DIR / filename
     raise HTTPException(
-        status_code=status.HTTP_404_NOT_FOUND, detail="Could not find event"
+        status_code=status.HTTP_406_NOT_ACCEPTABLE, detail="Event has no avatar"
     )
@@ -0,0 +1,143 @@
+import asyncio
+import functools
+import logging
+import multiprocessing
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from email.utils import parsedate
+from pathlib import Path
+
+from starlette.datastructures import Headers
+
+from core.cache import TTLCache
+from core.config import settings
+from core.images import render_variants, variant_filename
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_DIR = Path(__file__).resolve().parent.parent.parent / "uploads/avatars"
+UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+DEFAULT_PREVIEW = (
+    Path(__file__).resolve().parent.parent.parent
+    / "uploads/defaults/default-event-preview.jpg"
+)
+
+# Имя файла содержит время загрузки, поэтому по имени содержимое не меняется
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+# event_id -> имя файла превью (None — превью не загружено)
+preview_filenames = TTLCache(
+    maxsize=settings.previews.lookup_cache_size,
+    ttl=settings.previews.lookup_cache_ttl,
+)
+
+
+def preview_filename_pattern(event_id: int) -> re.Pattern:
+    variants = "|".join(map(re.escape, settings.previews.variants))
+    return re.compile(
+        rf"{event_id}_event_preview_\d+(\.(jpg|png|gif|webp)|_({variants})\.webp)"
+    )
+
+
+def stat_file(path: Path) -> os.stat_result | None:
+    try:
+        return os.stat(path)
+    except FileNotFoundError:
+        return None
+
+
+@functools.cache
+def default_preview_stat() -> os.stat_result | None:
+    return stat_file(DEFAULT_PREVIEW)
+
+
+def is_not_modified(response_headers: Headers, request_headers: Headers) -> bool:
+    # Как StaticFiles.is_not_modified: If-None-Match важнее If-Modified-Since
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match is not None:
+        etag = response_headers.get("etag")
+        tags = [tag.strip(" W/") for tag in if_none_match.split(",")]
+        return if_none_match.strip() == "*" or etag in tags
+    if_modified_since = parsedate(request_headers.get("if-modified-since", ""))
+    last_modified = parsedate(response_headers.get("last-modified", ""))
+    return (
+        if_modified_since is not None
+        and last_modified is not None
+        and if_modified_since >= last_modified
+    )
+
+
+class PreviewPipeline:
+    """Фоновая нарезка превью событий в пуле процессов: декодирование и
+    сжатие изображений не занимают event loop."""
+
+    def __init__(
+        self,
+        upload_dir: Path,
+        workers: int,
+        variants: dict[str, int],
+        quality: int,
+    ):
+        self.upload_dir = upload_dir
+        self.workers = workers
+        self.variants = variants
+        self.quality = quality
+        self.pool: ProcessPoolExecutor | None = None
+        self._tasks: set[asyncio.Task] = set()
+
+    def start(self) -> None:
+        if self.pool is None:
+            # spawn: форк процесса с работающим event loop и потоками небезопасен
+            self.pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+
+    async def stop(self) -> None:
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self.pool is not None:
+            pool, self.pool = self.pool, None
+            await asyncio.to_thread(pool.shutdown)
+
+    def variant_path(self, filename: str, variant: str) -> Path:
+        return self.upload_dir / variant_filename(filename, variant)
+
+    def submit(self, filename: str) -> asyncio.Task:
+        task = asyncio.create_task(self.render(filename))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def render(self, filename: str) -> dict[str, str]:
+        if self.pool is None:
+            self.start()
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(
+                self.pool,
+                render_variants,
+                str(self.upload_dir / filename),
+                self.variants,
+                self.quality,
+            )
+        except Exception:
+            # Без вариантов отдаётся исходный файл
+            logger.exception("Failed to render preview variants for %s", filename)
+            return {}
+
+    async def remove(self, filename: str) -> None:
+        paths = [self.upload_dir / filename]
+        paths += [self.variant_path(filename, variant) for variant in self.variants]
+        for path in paths:
+            await asyncio.to_thread(path.unlink, missing_ok=True)
+
+
+preview_pipeline = PreviewPipeline(
+    upload_dir=UPLOAD_DIR,
+    workers=settings.previews.workers,
+    variants=settings.previews.variants,
+    quality=settings.previews.quality,
+)
@@ -1,4 +1,6 @@
-from pydantic import BaseModel, ConfigDict
+from datetime import datetime
+
+from pydantic import BaseModel, ConfigDict, Field
 
 
 class EventBase(BaseModel):
@@ -22,8 +24,43 @@ class Event(EventBase):
     id: int
 
 
-class EventsInArea(BaseModel):
+class EventDetail(Event):
+    preview_picture: str | None = None
+    created_by: int
+    created_at: datetime
+    updated_at: datetime
+    participants_count: int
+    # Первые участники с данными из сервиса пользователей (или только id,
+    # если данных нет); полный список — /events/{event_id}/participants
+    participants: list[dict | int] = []
+
+
+class Participant(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+    user_id: int
+    joined_at: datetime
+
+
+class Area(BaseModel):
     min_latitude: float
     max_latitude: float
     min_longitude: float
     max_longitude: float
+
+
+class EventsInArea(Area):
+    # Ответ всегда ограничен; следующая страница запрашивается
+    # с after_id = id последнего события
+    limit: int = Field(default=100, ge=1, le=1000)
+    after_id: int | None = None
+
+
+class EventsClustersInArea(Area):
+    zoom: int = Field(ge=0, le=22)
+
+
+class EventCluster(BaseModel):
+    latitude: float
+    longitude: float
+    count: int
+    event_ids: list[int]
@@ -1,38 +1,88 @@
+import asyncio
+import os
 from pathlib import Path
 
-from fastapi import APIRouter, HTTPException, status, Depends, UploadFile, File
-from fastapi.responses import FileResponse
-
-from core.config import settings
+from fastapi import (
+    APIRouter,
+    HTTPException,
+    status,
+    Depends,
+    UploadFile,
+    File,
+    Query,
+    Request,
+    Response,
+)
+from fastapi.responses import FileResponse, StreamingResponse
+from starlette.staticfiles import NotModifiedResponse
+
+from core.users_service import UsersServiceClient, get_users_service
 from . import crud
 from .crud import add_participant_to_event, save_image, get_event_preview
-from .schemas import Event, EventCreate, EventUpdate, EventsInArea
+from .previews import (
+    DEFAULT_PREVIEW,
+    IMMUTABLE_CACHE_CONTROL,
+    REVALIDATE_CACHE_CONTROL,
+    UPLOAD_DIR,
+    default_preview_stat,
+    is_not_modified,
+    preview_filename_pattern,
+    stat_file,
+)
+from .schemas import (
+    Event,
+    EventCreate,
+    EventDetail,
+    EventUpdate,
+    EventsInArea,
+    EventsClustersInArea,
+    EventCluster,
+    Participant,
+)
 from core.models import db_helper
 from sqlalchemy.ext.asyncio import AsyncSession
-from .dependencies import event_by_id
-from ..auth import decode_access_token
+from .dependencies import event_by_id, owned_event_by_id
+from ..auth import get_current_user_id
 
 router = APIRouter(tags=["Events"])
 
 
+async def events_ndjson(after_id: int | None):
+    async for events in crud.stream_events(after_id=after_id):
+        yield "".join(
+            Event.model_validate(event).model_dump_json() + "\n" for event in events
+        )
+
+
 @router.get("/", response_model=list[Event])
 async def get_events(
+    after_id: int | None = None,
+    limit: int = Query(default=100, ge=1, le=1000),
+    stream: bool = False,
     session: AsyncSession = Depends(db_helper.session_dependency),
 ):
-    return await crud.get_events(session=session)
+    # stream=true отдаёт все события после after_id построчно (NDJSON), limit не применяется
+    if stream:
+        return StreamingResponse(
+            events_ndjson(after_id=after_id), media_type="application/x-ndjson"
+        )
+    return await crud.get_events(session=session, after_id=after_id, limit=limit)
 
 
-@router.post("/{event_id}/")
+@router.post("/{event_id}/", response_model=EventDetail)
 async def get_event(
     token: str,
     event_id: int,
-    user_service_url: str = settings.user_service_url,
+    # Проверяем токен до обращения к кэшу профилей: раньше его отклонял
+    # только сервис пользователей
+    user_id: int = Depends(get_current_user_id),
+    users_client: UsersServiceClient = Depends(get_users_service),
     session: AsyncSession = Depends(db_helper.session_dependency),
 ):
     event = await crud.get_event(
         session=session,
         event_id=event_id,
-        user_service_url=user_service_url,
+        users_client=users_client,
         token=token,
     )
     if event is not None:
@@ -43,6 +93,21 @@ async def get_event(
     )
 
 
+@router.get("/{event_id}/participants", response_model=list[Participant])
+async def get_event_participants(
+    event: Event = Depends(event_by_id),
+    after_id: int | None = None,
+    limit: int = Query(default=100, ge=1, le=1000),
+    # Список участников доступен только с токеном
+    user_id: int = Depends(get_current_user_id),
+    session: AsyncSession = Depends(db_helper.session_dependency),
+):
+    # Следующая страница запрашивается с after_id = user_id последнего участника
+    return await crud.get_participants(
+        session=session, event_id=event.id, after_id=after_id, limit=limit
+    )
+
+
 @router.post("/", response_model=Event)
 async def create_event(
     event_in: EventCreate,
@@ -54,7 +119,7 @@ async def create_event(
 @router.patch("/{event_id}/")
 async def update_event(
     event_update: EventUpdate,
-    event: Event = Depends(event_by_id),
+    event: Event = Depends(owned_event_by_id),
     session: AsyncSession = Depends(db_helper.session_dependency),
 ):
     return await crud.update_event(
@@ -66,7 +131,7 @@ async def update_event(
 
 @router.delete("/{event_id}/", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_event(
-    event: Event = Depends(event_by_id),
+    event: Event = Depends(owned_event_by_id),
     session: AsyncSession = Depends(db_helper.session_dependency),
 ) -> None:
     await crud.delete_event(session=session, event=event)
@@ -80,13 +145,20 @@ async def events_in_area(
     return await crud.events_in_area(area=area, session=session)
 
 
-@router.post("/addParticipant/{event_id}")
+@router.post("/in/area/clusters/", response_model=list[EventCluster])
+async def event_clusters_in_area(
+    area: EventsClustersInArea,
+    session: AsyncSession = Depends(db_helper.session_dependency),
+):
+    return await crud.event_clusters_in_area(area=area, session=session)
+
+
+@router.post("/addParticipant/{event_id}", response_model=EventDetail)
 async def add_participant_to_event_view(
     event_id: int,
-    token: str,
+    user_id: int = Depends(get_current_user_id),
     session: AsyncSession = Depends(db_helper.session_dependency),
 ):
-    user_id = int(decode_access_token(token=token))
     return await add_participant_to_event(
         event_id=event_id, user_id=user_id, session=session
     )
@@ -97,33 +169,74 @@ async def upload_event_preview(
     event_id: int,
     file: UploadFile = File(...),
     session: AsyncSession = Depends(db_helper.session_dependency),
-    user: int = Depends(decode_access_token),
+    user: int = Depends(get_current_user_id),
 ):
     return await save_image(session=session, user_id=user, file=file, event_id=event_id)
 
 
+def preview_response(
+    request: Request,
+    path: Path,
+    stat_result: os.stat_result,
+    cache_control: str,
+) -> Response:
+    # Range и If-Range обрабатывает сам FileResponse
+    response = FileResponse(
+        path, stat_result=stat_result, headers={"Cache-Control": cache_control}
+    )
+    if is_not_modified(response.headers, request.headers):
+        return NotModifiedResponse(response.headers)
+    return response
+
+
 @router.get("/preview/{event_id}", response_class=FileResponse)
 async def get_preview(
+    request: Request,
     event_id: int,
+    size: str | None = None,
     session: AsyncSession = Depends(db_helper.session_dependency),
 ):
+    # size — вариант из settings.previews.variants (pin, card, full); без него исходник.
+    # Ответ можно кэшировать только с перепроверкой: превью события может смениться
     try:
-        avatar_path = await get_event_preview(event_id=event_id, session=session)
-        if avatar_path.exists():
-            return FileResponse(avatar_path, headers={"Cache-Control": "no-store"})
-    except HTTPException as e:
-        if e.status_code == 404:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=e.detail)
-        elif e.status_code == 406:
-            default_avatar_path = (
-                Path(__file__).resolve().parent.parent.parent
-                / "uploads/defaults/default-event-preview.jpg"
-            )
-            if not default_avatar_path.exists():
-                raise HTTPException(
-                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                    detail="Default preview not found",
-                )
-            return FileResponse(
-                default_avatar_path, headers={"Cache-Control": "no-store"}
+        avatar_path = await get_event_preview(
+            event_id=event_id, session=session, size=size
+        )
+        stat_result = await asyncio.to_thread(stat_file, avatar_path)
+        if stat_result is not None:
+            return preview_response(
+                request, avatar_path, stat_result, REVALIDATE_CACHE_CONTROL
             )
+    except HTTPException as e:
+        if e.status_code != 406:
+            raise
+    stat_result = default_preview_stat()
+    if stat_result is None:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Default preview not found",
+        )
+    return preview_response(
+        request, DEFAULT_PREVIEW, stat_result, REVALIDATE_CACHE_CONTROL
+    )
+
+
+@router.get("/preview/{event_id}/{filename}", response_class=FileResponse)
+async def get_versioned_preview(
+    request: Request,
+    event_id: int,
+    filename: str,
+):
+    # Адрес по имени файла (preview_picture или его вариант) не меняет содержимое,
+    # поэтому кэшируется навсегда и обслуживается без БД
+    if not preview_filename_pattern(event_id).fullmatch(filename):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Preview not found"
+        )
+    path = UPLOAD_DIR / filename
+    stat_result = await asyncio.to_thread(stat_file, path)
+    if stat_result is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Preview not found"
+        )
+    return preview_response(request, path, stat_result, IMMUTABLE_CACHE_CONTROL)
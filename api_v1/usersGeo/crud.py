@@ -1,13 +1,32 @@
-import httpx
+import asyncio
+import hashlib
+import logging
+from datetime import date, datetime, timedelta
+
 from sqlalchemy.exc import NoResultFound
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import Text, cast, literal_column, select, text
 from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import aggregate_order_by, insert
 from api_v1.auth import decode_access_token
 from api_v1.usersGeo.schemas import UserGeoUpdate, UserGeoResponce
+from api_v1.usersGeo.spatialIndex import users_geo_index
+from core.cache import AsyncTTLCache
+from core.config import settings
+from core.models import db_helper
 from core.models.UserGeo import UserGeo
+from core.models.UserGeoHistory import UserGeoHistory
+from core.users_service import UsersServiceClient, UsersServiceUnavailable
 from fastapi import status, HTTPException
 
+logger = logging.getLogger(__name__)
+
+# Списки друзей между двумя GPS-пингами почти не меняются
+friends_cache = AsyncTTLCache(
+    maxsize=settings.friends_cache.maxsize,
+    ttl=settings.friends_cache.ttl,
+)
+
 
 async def update_or_create_user_geo(
     user_id: int,
@@ -23,6 +42,7 @@ async def update_or_create_user_geo(
         # Обновляем координаты
         if new_geo.latitude and new_geo.longitude:
             user_geo.location = f"POINT({new_geo.longitude} {new_geo.latitude})"
+            user_geo.updated_at = datetime.now()
     except NoResultFound:
         location = f"POINT({new_geo.longitude} {new_geo.latitude})"
         user_geo = UserGeo(user_id=user_id, location=location)
@@ -30,30 +50,382 @@ async def update_or_create_user_geo(
 
     await session.commit()
     await session.refresh(user_geo)  # Обновляем объект из базы
-    return user_geo.to_dict()  # Возвращаем данные как словарь
+    user_geo_data = user_geo.to_dict()  # Возвращаем данные как словарь
+    users_geo_index.update(
+        int(user_id),
+        user_geo_data["latitude"],
+        user_geo_data["longitude"],
+        stamp=user_geo_data["updated_at"],
+    )
+    return user_geo_data
+
+
+async def upsert_users_geo(
+    session: AsyncSession,
+    points: list[dict],
+) -> set[int]:
+    """Одним INSERT ... ON CONFLICT (user_id) DO UPDATE записывает пачку точек
+    вида {"user_id", "latitude", "longitude", "updated_at"}.
+    Более старая точка не перезаписывает уже сохранённую свежую.
+    Точки передаются массивами через unnest: четыре параметра на любой размер
+    пачки. Возвращает user_id, чьи позиции записаны."""
+    if not points:
+        return set()
+    result = await session.execute(
+        text(
+            """
+            INSERT INTO "UsersGeo" (user_id, location, updated_at)
+            SELECT
+                point.user_id,
+                ST_SetSRID(ST_MakePoint(point.longitude, point.latitude), 4326),
+                point.updated_at
+            FROM unnest(
+                CAST(:user_ids AS integer[]),
+                CAST(:latitudes AS double precision[]),
+                CAST(:longitudes AS double precision[]),
+                CAST(:updated_at AS timestamp[])
+            ) AS point(user_id, latitude, longitude, updated_at)
+            ON CONFLICT (user_id) DO UPDATE
+            SET location = excluded.location, updated_at = excluded.updated_at
+            WHERE "UsersGeo".updated_at IS NULL
+                OR "UsersGeo".updated_at <= excluded.updated_at
+            RETURNING user_id
+            """
+        ),
+        {
+            "user_ids": [point["user_id"] for point in points],
+            "latitudes": [point["latitude"] for point in points],
+            "longitudes": [point["longitude"] for point in points],
+            "updated_at": [point["updated_at"] for point in points],
+        },
+    )
+    applied = set(result.scalars().all())
+    await session.commit()
+    return applied
+
+
+INT4_MAX = 2**31 - 1
+
+
+def parse_bulk_point(item) -> dict:
+    """Проверяет элемент пакетной загрузки без pydantic: на десятках тысяч
+    точек валидация моделью заметно дороже самого upsert."""
+    if not isinstance(item, dict):
+        raise ValueError("Item must be an object")
+    user_id = item["user_id"]
+    if not isinstance(user_id, int) or isinstance(user_id, bool):
+        raise ValueError("user_id must be an integer")
+    # Колонка user_id — int4: иначе ошибка вылетит из upsert на всю пачку
+    if not 0 < user_id <= INT4_MAX:
+        raise ValueError("user_id out of range")
+    # NaN не проходит сравнения
+    latitude = float(item["latitude"])
+    longitude = float(item["longitude"])
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise ValueError("Coordinates out of range")
+    timestamp = item["timestamp"]
+    if isinstance(timestamp, (int, float)) and not isinstance(timestamp, bool):
+        updated_at = datetime.fromtimestamp(timestamp)
+    elif isinstance(timestamp, str):
+        updated_at = datetime.fromisoformat(timestamp)
+        # В БД наивное локальное время, как у datetime.now()
+        if updated_at.tzinfo is not None:
+            updated_at = updated_at.astimezone().replace(tzinfo=None)
+    else:
+        raise ValueError("timestamp must be an ISO 8601 string or epoch seconds")
+    skew = timedelta(seconds=settings.geo_bulk.max_future_skew)
+    if updated_at > datetime.now() + skew:
+        raise ValueError("timestamp is in the future")
+    return {
+        "user_id": user_id,
+        "latitude": latitude,
+        "longitude": longitude,
+        "updated_at": updated_at,
+    }
+
+
+async def bulk_upsert_users_geo(session: AsyncSession, items: list) -> dict:
+    """Пакетная запись позиций с last-write-wins по timestamp.
+
+    Статусы элементов: applied — позиция записана; stale — в БД уже есть
+    более свежая; superseded — в этом же пакете есть более свежая точка того
+    же пользователя; invalid — элемент не прошёл проверку.
+    """
+    statuses: list[dict] = [{"status": "superseded"} for _ in items]
+    latest: dict[int, tuple[int, dict]] = {}
+    for index, item in enumerate(items):
+        try:
+            point = parse_bulk_point(item)
+        except (KeyError, TypeError, ValueError, OverflowError, OSError) as e:
+            error = f"Missing field {e}" if isinstance(e, KeyError) else str(e)
+            statuses[index] = {"status": "invalid", "error": error}
+            continue
+        current = latest.get(point["user_id"])
+        if current is None or current[1]["updated_at"] <= point["updated_at"]:
+            latest[point["user_id"]] = (index, point)
+
+    points = [point for _, point in latest.values()]
+    chunk_size = settings.geo_bulk.chunk_size
+    applied: set[int] = set()
+    for start in range(0, len(points), chunk_size):
+        applied |= await upsert_users_geo(
+            session=session, points=points[start : start + chunk_size]
+        )
+
+    for index, point in latest.values():
+        if point["user_id"] in applied:
+            statuses[index] = {"status": "applied"}
+            users_geo_index.update(
+                point["user_id"],
+                point["latitude"],
+                point["longitude"],
+                stamp=point["updated_at"],
+            )
+        else:
+            statuses[index] = {"status": "stale"}
+
+    counts = dict.fromkeys(("applied", "stale", "superseded", "invalid"), 0)
+    for item_status in statuses:
+        counts[item_status["status"]] += 1
+    return {**counts, "items": statuses}
+
+
+async def insert_users_geo_history(
+    records: list[tuple[int, datetime, float, float]],
+) -> None:
+    """Пишет записи (user_id, recorded_at, latitude, longitude) в журнал через COPY."""
+    if not records:
+        return
+    columns = ["user_id", "recorded_at", "latitude", "longitude"]
+    async with db_helper.engine.connect() as conn:
+        raw = await conn.get_raw_connection()
+        driver_connection = raw.driver_connection
+        if hasattr(driver_connection, "copy_records_to_table"):
+            await driver_connection.copy_records_to_table(
+                UserGeoHistory.__tablename__, records=records, columns=columns
+            )
+            return
+        await conn.execute(
+            insert(UserGeoHistory),
+            [dict(zip(columns, record)) for record in records],
+        )
+        await conn.commit()
+
+
+def history_partition_name(day: date) -> str:
+    return f"{UserGeoHistory.__tablename__}_p{day:%Y%m%d}"
+
+
+async def maintain_history_partitions(
+    session: AsyncSession,
+    today: date | None = None,
+) -> None:
+    """Создаёт секции журнала на ближайшие дни и удаляет вышедшие за срок хранения."""
+    today = today or date.today()
+    table = UserGeoHistory.__tablename__
+    for offset in range(settings.history.partitions_ahead + 1):
+        day = today + timedelta(days=offset)
+        await session.execute(
+            text(
+                f'CREATE TABLE IF NOT EXISTS "{history_partition_name(day)}" '
+                f'PARTITION OF "{table}" '
+                f"FOR VALUES FROM ('{day.isoformat()}') "
+                f"TO ('{(day + timedelta(days=1)).isoformat()}')"
+            )
+        )
+
+    oldest = today - timedelta(days=settings.history.retention_days)
+    result = await session.execute(
+        text(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+            "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+            "WHERE parent.relname = :table"
+        ),
+        {"table": table},
+    )
+    for partition in result.scalars().all():
+        try:
+            day = datetime.strptime(partition.rsplit("_p", 1)[1], "%Y%m%d").date()
+        except (IndexError, ValueError):
+            continue
+        if day < oldest:
+            await session.execute(text(f'DROP TABLE IF EXISTS "{partition}"'))
+    await session.commit()
+
+
+async def run_history_maintenance() -> None:
+    while True:
+        await asyncio.sleep(settings.history.maintenance_interval)
+        try:
+            async with db_helper.session_factory() as session:
+                await maintain_history_partitions(session=session)
+        except Exception:
+            logger.exception("Не удалось обслужить секции журнала геопозиций")
+
+
+async def get_trajectory(
+    session: AsyncSession,
+    user_id: int,
+    start: datetime,
+    end: datetime,
+    tolerance: float,
+) -> list[dict]:
+    """Трек пользователя за [start, end), упрощённый Douglas-Peucker (ST_Simplify).
+    Время точки хранится в M-координате и переживает упрощение; tolerance в
+    метрах применяется в EPSG:3857, то есть приблизительно. preserveCollapsed:
+    трек стоявшего на месте пользователя иначе схлопнулся бы в NULL."""
+    result = await session.execute(
+        text(
+            """
+            WITH track AS (
+                SELECT ST_SetSRID(
+                    ST_MakeLine(
+                        ST_MakePointM(longitude, latitude, extract(epoch FROM recorded_at))
+                        ORDER BY recorded_at
+                    ),
+                    4326
+                ) AS line
+                FROM "UsersGeoHistory"
+                WHERE user_id = :user_id
+                    AND recorded_at >= :start
+                    AND recorded_at < :end
+            ), simplified AS (
+                SELECT ST_Transform(
+                    ST_Simplify(ST_Transform(line, 3857), :tolerance, true), 4326
+                ) AS line
+                FROM track
+            )
+            SELECT
+                ST_Y(point.geom) AS latitude,
+                ST_X(point.geom) AS longitude,
+                to_timestamp(ST_M(point.geom)) AT TIME ZONE 'UTC' AS recorded_at
+            FROM simplified, ST_DumpPoints(simplified.line) AS point
+            ORDER BY point.path
+            """
+        ),
+        {"user_id": user_id, "start": start, "end": end, "tolerance": tolerance},
+    )
+    return [
+        {
+            "latitude": row.latitude,
+            "longitude": row.longitude,
+            "recorded_at": row.recorded_at,
+        }
+        for row in result
+    ]
+
+
+async def sync_users_geo_index(
+    session: AsyncSession,
+    since: datetime | None = None,
+) -> datetime | None:
+    """Загружает в индекс точки, изменённые после since. Точки за последние
+    sync_overlap секунд перечитываются: строка с более ранним updated_at могла
+    закоммититься уже после прошлой синхронизации, а повторная запись в индекс
+    безопасна благодаря проверке stamp.
+    Возвращает максимальный updated_at для следующей синхронизации."""
+    stmt = select(
+        UserGeo.user_id,
+        func.ST_Y(UserGeo.location).label("latitude"),
+        func.ST_X(UserGeo.location).label("longitude"),
+        UserGeo.updated_at,
+    )
+    if since is not None:
+        overlap = timedelta(seconds=settings.geo_index.sync_overlap)
+        stmt = stmt.where(UserGeo.updated_at > since - overlap)
+    result = await session.stream(stmt.execution_options(yield_per=1000))
+    async for row in result:
+        users_geo_index.update(
+            row.user_id, row.latitude, row.longitude, stamp=row.updated_at
+        )
+        if row.updated_at is not None and (since is None or row.updated_at > since):
+            since = row.updated_at
+    return since
+
+
+async def run_users_geo_index_sync(since: datetime | None = None) -> None:
+    # Точки, записанные другими воркерами, попадают в индекс с задержкой sync_interval
+    while True:
+        await asyncio.sleep(settings.geo_index.sync_interval)
+        try:
+            async with db_helper.session_factory() as session:
+                since = await sync_users_geo_index(session=session, since=since)
+        except Exception:
+            logger.exception("Не удалось синхронизировать индекс геопозиций")
 
 
 async def get_users_geo(
     user_ids: list[int],
     session: AsyncSession,
+    since: datetime | None = None,
 ) -> list[dict]:
-    result = await session.execute(select(UserGeo).where(UserGeo.user_id.in_(user_ids)))
-    user_geos = result.scalars().all()
+    # Координаты берём из SQL: без разбора WKB в объекты Shapely на каждую строку
+    stmt = select(
+        UserGeo.user_id,
+        func.ST_Y(UserGeo.location).label("latitude"),
+        func.ST_X(UserGeo.location).label("longitude"),
+        UserGeo.updated_at,
+    ).where(UserGeo.user_id.in_(user_ids))
+    if since is not None:
+        stmt = stmt.where(UserGeo.updated_at > since)
+    result = await session.execute(stmt)
+    return [row._asdict() for row in result]
 
-    return [user_geo.to_dict() for user_geo in user_geos]
 
+async def get_users_geo_etag(
+    user_ids: list[int],
+    session: AsyncSession,
+    since: datetime | None = None,
+) -> str:
+    """ETag набора позиций: меняется, когда кто-то из пользователей сдвинулся
+    или изменился сам набор. Считается одним агрегатом в БД: md5 по строкам
+    (id, время, точка), поэтому видна и запись задним числом из /bulk, которая
+    не поднимает max(updated_at)."""
+    row_key = func.concat_ws(
+        ":", UserGeo.user_id, UserGeo.updated_at, cast(UserGeo.location, Text)
+    )
+    rows_hash = func.md5(
+        func.string_agg(
+            row_key, aggregate_order_by(literal_column("';'"), UserGeo.user_id)
+        )
+    )
+    result = await session.execute(
+        select(rows_hash).where(UserGeo.user_id.in_(user_ids))
+    )
+    key = f"{sorted(user_ids)}|{result.scalar_one()}|{since}"
+    return f'"{hashlib.md5(key.encode(), usedforsecurity=False).hexdigest()}"'
 
 
 async def get_friend_list(
     token: str,
-    user_service_url: str,
-):
+    users_client: UsersServiceClient,
+    user_id: int | None = None,
+) -> list[int]:
+    if user_id is None:
+        try:
+            user_id = int(decode_access_token(token))
+        except ValueError as e:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=str(e))
+    return await friends_cache.get_or_load(
+        user_id,
+        lambda: fetch_friend_list(token=token, users_client=users_client),
+    )
+
+
+def invalidate_friend_lists(user_ids: list[int]) -> int:
+    return sum(friends_cache.invalidate(user_id) for user_id in user_ids)
+
+
+async def fetch_friend_list(
+    token: str,
+    users_client: UsersServiceClient,
+) -> list[int]:
     headers = {"Authorization": f"Bearer {token}"}
-    async with httpx.AsyncClient() as client:
-        response = await client.get(
-            f"{user_service_url}/api/v1/friends/friendsList",
-            headers=headers,
-        )
+    response = await users_client.get(
+        "/api/v1/friends/friendsList",
+        headers=headers,
+    )
 
     if response.status_code == 200:
         friend_ids = response.json()
@@ -69,59 +441,96 @@ async def get_friend_list(
 async def get_users_friends_geo(
     token: str,
     session: AsyncSession,
-    user_service_url: str,
-) -> list[dict]:
-    friend_ids = await get_friend_list(token=token, user_service_url=user_service_url)
+    users_client: UsersServiceClient,
+    since: datetime | None = None,
+    if_none_match: str | None = None,
+) -> tuple[str, list[dict] | None]:
+    """Возвращает ETag и позиции друзей; позиций нет (None), если ETag совпал
+    с if_none_match и клиенту достаточно ответить 304."""
+    try:
+        friend_ids = await get_friend_list(token=token, users_client=users_client)
+    except UsersServiceUnavailable as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e)
+        )
+
+    etag = await get_users_geo_etag(user_ids=friend_ids, session=session, since=since)
+    if if_none_match is not None and etag in [
+        tag.strip(" W/") for tag in if_none_match.split(",")
+    ]:
+        return etag, None
 
-    friends_geo = await get_users_geo(user_ids=friend_ids, session=session)
+    friends_geo = await get_users_geo(user_ids=friend_ids, session=session, since=since)
 
-    return friends_geo
+    return etag, friends_geo
 
 
 async def get_nearby_users(
     token: str,
     session: AsyncSession,
-    max_distance: float = 5000,  # Максимальное расстояние в метрах
+    max_distance: float = settings.nearby_users.default_radius,  # В метрах
+    limit: int = settings.nearby_users.default_limit,
 ) -> list[dict]:
     try:
-        user_id = decode_access_token(token)
+        user_id = int(decode_access_token(token))
     except ValueError as e:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=str(e))
 
-    # Получаем координаты текущего пользователя
-    user_geo = await session.execute(
-        select(UserGeo).where(UserGeo.user_id == user_id)
-    )
-    user_geo = user_geo.scalar_one_or_none()
+    # Если позиция пользователя уже есть в индексе, отвечаем без запросов к БД
+    point = users_geo_index.get(user_id)
+    if point is not None:
+        return [
+            {"user_id": nearby_user_id, "distance": distance}
+            for nearby_user_id, distance in users_geo_index.nearest(
+                *point, k=limit, max_distance=max_distance, exclude=user_id
+            )
+        ]
 
-    if not user_geo:
+    # Один запрос: позиция пользователя и KNN-обход GIST-индекса по geography.
+    # Строк нет — позиция не найдена; соседей нет — одна строка с NULL
+    result = await session.execute(
+        text(
+            """
+            SELECT
+                me.updated_at,
+                ST_Y(me.location) AS latitude,
+                ST_X(me.location) AS longitude,
+                nearby.user_id,
+                nearby.distance
+            FROM "UsersGeo" AS me
+            LEFT JOIN LATERAL (
+                SELECT
+                    other.user_id,
+                    ST_Distance(
+                        other.location::geography, me.location::geography
+                    ) AS distance
+                FROM "UsersGeo" AS other
+                WHERE other.user_id <> me.user_id
+                    AND ST_DWithin(
+                        other.location::geography,
+                        me.location::geography,
+                        :max_distance
+                    )
+                ORDER BY other.location::geography <-> me.location::geography
+                LIMIT :limit
+            ) AS nearby ON true
+            WHERE me.user_id = :user_id
+            """
+        ),
+        {"user_id": user_id, "max_distance": max_distance, "limit": limit},
+    )
+    rows = result.all()
+    if not rows:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="User location not found",
         )
-
-    # Находим ближайших пользователей
-    query = (
-        select(
-            UserGeo.user_id,
-            func.ST_DistanceSphere(
-                UserGeo.location, user_geo.location
-            ).label("distance")
-        )
-        .where(UserGeo.user_id != user_id)  # Исключаем самого пользователя
-        .where(
-            func.ST_DWithin(
-                UserGeo.location, user_geo.location, max_distance
-            )
-        )  # Условие на расстояние
-        .order_by("distance")
-        .limit(5)
+    users_geo_index.update(
+        user_id, rows[0].latitude, rows[0].longitude, stamp=rows[0].updated_at
     )
 
-    result = await session.execute(query)
-    nearby_users = result.fetchall()
-
     return [
         {"user_id": row.user_id, "distance": row.distance}
-        for row in nearby_users
+        for row in rows
+        if row.user_id is not None
     ]
@@ -0,0 +1,174 @@
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+from datetime import datetime
+
+from api_v1.usersGeo.crud import upsert_users_geo, insert_users_geo_history
+from core.config import settings
+from core.models import db_helper
+
+logger = logging.getLogger(__name__)
+
+
+class BatchWriter(ABC):
+    """Фоновая запись пачками: по таймеру, при достижении max_batch_size
+    и при остановке приложения."""
+
+    def __init__(self, flush_interval: float, max_batch_size: int):
+        self.flush_interval = flush_interval
+        self.max_batch_size = max_batch_size
+        self._flush_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    @abstractmethod
+    def __len__(self) -> int: ...
+
+    @abstractmethod
+    def _take(self) -> list: ...
+
+    @abstractmethod
+    def _restore(self, batch: list) -> None: ...
+
+    @abstractmethod
+    async def _write(self, batch: list) -> None: ...
+
+    def _added(self) -> None:
+        if len(self) >= self.max_batch_size:
+            self._wakeup.set()
+
+    async def flush(self) -> None:
+        async with self._flush_lock:
+            if not len(self):
+                return
+            batch = self._take()
+            try:
+                await self._write(batch)
+            except Exception:
+                self._restore(batch)
+                raise
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Не удалось записать пачку в %s", type(self).__name__)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+
+class GeoWriteBehind(BatchWriter):
+    """Буфер последних геопозиций пользователей.
+
+    Для каждого пользователя хранится только самая свежая точка, она
+    попадает в UsersGeo одним INSERT ... ON CONFLICT на пачку.
+    """
+
+    def __init__(self, flush_interval: float, max_batch_size: int):
+        super().__init__(flush_interval=flush_interval, max_batch_size=max_batch_size)
+        self._pending: dict[int, dict] = {}
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def add(
+        self,
+        user_id: int,
+        latitude: float,
+        longitude: float,
+        updated_at: datetime | None = None,
+    ) -> None:
+        self._pending[user_id] = {
+            "user_id": user_id,
+            "latitude": latitude,
+            "longitude": longitude,
+            "updated_at": updated_at or datetime.now(),
+        }
+        self._added()
+
+    def _take(self) -> list[dict]:
+        batch, self._pending = self._pending, {}
+        return list(batch.values())
+
+    def _restore(self, batch: list[dict]) -> None:
+        # Возвращаем несохранённые точки, если за это время не пришли новее
+        for point in batch:
+            self._pending.setdefault(point["user_id"], point)
+
+    async def _write(self, batch: list[dict]) -> None:
+        async with db_helper.session_factory() as session:
+            for start in range(0, len(batch), self.max_batch_size):
+                await upsert_users_geo(
+                    session=session,
+                    points=batch[start : start + self.max_batch_size],
+                )
+
+
+class GeoHistoryWriter(BatchWriter):
+    """Буфер всех принятых геопозиций для журнала UsersGeoHistory."""
+
+    def __init__(self, flush_interval: float, max_batch_size: int, max_pending: int):
+        super().__init__(flush_interval=flush_interval, max_batch_size=max_batch_size)
+        self.max_pending = max_pending
+        self._pending: list[tuple[int, datetime, float, float]] = []
+        self.dropped = 0
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def add(
+        self,
+        user_id: int,
+        latitude: float,
+        longitude: float,
+        recorded_at: datetime,
+    ) -> None:
+        # Если БД долго недоступна, журнал теряет точки, а не память
+        if len(self._pending) >= self.max_pending:
+            self.dropped += 1
+            return
+        self._pending.append((user_id, recorded_at, latitude, longitude))
+        self._added()
+
+    def _take(self) -> list[tuple]:
+        batch, self._pending = self._pending, []
+        return batch
+
+    def _restore(self, batch: list[tuple]) -> None:
+        free = max(self.max_pending - len(self._pending), 0)
+        self.dropped += max(len(batch) - free, 0)
+        if free:
+            self._pending[:0] = batch[-free:]
+
+    async def _write(self, batch: list[tuple]) -> None:
+        await insert_users_geo_history(records=batch)
+
+
+geo_writer = GeoWriteBehind(
+    flush_interval=settings.geo_writer.flush_interval,
+    max_batch_size=settings.geo_writer.max_batch_size,
+)
+
+history_writer = GeoHistoryWriter(
+    flush_interval=settings.history.flush_interval,
+    max_batch_size=settings.history.max_batch_size,
+    max_pending=settings.history.max_pending,
+)
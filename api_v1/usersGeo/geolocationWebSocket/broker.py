@@ -0,0 +1,316 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import uuid
+from abc import ABC, abstractmethod
+from typing import Callable, Hashable
+
+from core.config import BrokerConfig
+
+logger = logging.getLogger(__name__)
+
+# Доставка сообщения локальным получателям: (user_ids, message, key)
+Deliver = Callable[[list[int], dict, Hashable | None], None]
+# Обработка служебного сообщения, разосланного всем узлам
+Broadcast = Callable[[dict], None]
+
+
+def default_node_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+
+class Broker(ABC):
+    """Маршрутизация сообщений между воркерами/репликами.
+
+    Каждый узел регистрирует пользователей, чьи сокеты он держит, и по
+    реестру присутствия пересылает сообщения узлу получателя. Служебные
+    сообщения (например, сброс кэшей) рассылаются всем узлам через broadcast.
+    """
+
+    def __init__(self, node_id: str):
+        self.node_id = node_id
+        self.deliver: Deliver | None = None
+        self.on_broadcast: Broadcast | None = None
+
+    async def start(
+        self, deliver: Deliver, on_broadcast: Broadcast | None = None
+    ) -> None:
+        self.deliver = deliver
+        self.on_broadcast = on_broadcast
+
+    async def stop(self) -> None:
+        self.deliver = None
+        self.on_broadcast = None
+
+    @abstractmethod
+    async def register(self, user_id: int) -> None: ...
+
+    @abstractmethod
+    async def unregister(self, user_id: int) -> None: ...
+
+    @abstractmethod
+    async def locate(self, user_ids: list[int]) -> dict[str, list[int]]:
+        """Группирует онлайн-пользователей по узлам, которые держат их сокеты."""
+
+    @abstractmethod
+    async def publish(
+        self,
+        node_id: str,
+        user_ids: list[int],
+        message: dict,
+        key: Hashable | None = None,
+    ) -> None: ...
+
+    @abstractmethod
+    async def broadcast(self, message: dict) -> None:
+        """Передаёт сообщение в on_broadcast всех остальных узлов."""
+
+
+class InProcessHub:
+    """Общее состояние для нескольких InProcessBroker в одном процессе (тесты)."""
+
+    def __init__(self):
+        self.presence: dict[int, str] = {}
+        self.nodes: dict[str, "InProcessBroker"] = {}
+
+
+class InProcessBroker(Broker):
+    def __init__(self, node_id: str, hub: InProcessHub | None = None):
+        super().__init__(node_id=node_id)
+        self.hub = hub or InProcessHub()
+
+    async def start(
+        self, deliver: Deliver, on_broadcast: Broadcast | None = None
+    ) -> None:
+        await super().start(deliver, on_broadcast)
+        self.hub.nodes[self.node_id] = self
+
+    async def stop(self) -> None:
+        self.hub.nodes.pop(self.node_id, None)
+        for user_id, node_id in list(self.hub.presence.items()):
+            if node_id == self.node_id:
+                del self.hub.presence[user_id]
+        await super().stop()
+
+    async def register(self, user_id: int) -> None:
+        self.hub.presence[user_id] = self.node_id
+
+    async def unregister(self, user_id: int) -> None:
+        if self.hub.presence.get(user_id) == self.node_id:
+            del self.hub.presence[user_id]
+
+    async def locate(self, user_ids: list[int]) -> dict[str, list[int]]:
+        nodes: dict[str, list[int]] = {}
+        for user_id in user_ids:
+            node_id = self.hub.presence.get(user_id)
+            if node_id is not None:
+                nodes.setdefault(node_id, []).append(user_id)
+        return nodes
+
+    async def publish(
+        self,
+        node_id: str,
+        user_ids: list[int],
+        message: dict,
+        key: Hashable | None = None,
+    ) -> None:
+        node = self.hub.nodes.get(node_id)
+        if node is not None and node.deliver is not None:
+            node.deliver(user_ids, message, key)
+
+    async def broadcast(self, message: dict) -> None:
+        for node in list(self.hub.nodes.values()):
+            if node is not self and node.on_broadcast is not None:
+                node.on_broadcast(message)
+
+
+# Удаляем запись присутствия, только если она всё ещё принадлежит этому узлу
+_UNREGISTER_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class RedisBroker(Broker):
+    """Реестр присутствия на ключах Redis с TTL, канал pub/sub на каждый узел
+    и общий канал для служебных сообщений всем узлам."""
+
+    def __init__(
+        self,
+        node_id: str,
+        url: str,
+        presence_ttl: int,
+        prefix: str = "geo",
+        reconnect_delay: float = 0.5,
+        reconnect_max_delay: float = 30.0,
+    ):
+        super().__init__(node_id=node_id)
+        import redis.asyncio as redis
+
+        self.redis = redis.from_url(url)
+        self.presence_ttl = presence_ttl
+        self.reconnect_delay = reconnect_delay
+        self.reconnect_max_delay = reconnect_max_delay
+        self.prefix = prefix
+        self.local_users: set[int] = set()
+        self._unregister = self.redis.register_script(_UNREGISTER_SCRIPT)
+        self._pubsub = None
+        self._tasks: list[asyncio.Task] = []
+
+    def _presence_key(self, user_id: int) -> str:
+        return f"{self.prefix}:presence:{user_id}"
+
+    def _channel(self, node_id: str) -> str:
+        return f"{self.prefix}:node:{node_id}"
+
+    @property
+    def _broadcast_channel(self) -> str:
+        return f"{self.prefix}:broadcast"
+
+    async def _subscribe(self) -> None:
+        self._pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        await self._pubsub.subscribe(
+            self._channel(self.node_id), self._broadcast_channel
+        )
+
+    async def _drop_subscription(self) -> None:
+        pubsub, self._pubsub = self._pubsub, None
+        if pubsub is not None:
+            try:
+                await pubsub.aclose()
+            except Exception:
+                pass
+
+    async def start(
+        self, deliver: Deliver, on_broadcast: Broadcast | None = None
+    ) -> None:
+        await super().start(deliver, on_broadcast)
+        await self._subscribe()
+        self._tasks = [
+            asyncio.create_task(self._listen()),
+            asyncio.create_task(self._heartbeat()),
+        ]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        await self._drop_subscription()
+        for user_id in list(self.local_users):
+            await self.unregister(user_id)
+        await self.redis.aclose()
+        await super().stop()
+
+    async def _listen(self) -> None:
+        # При обрыве соединения с Redis переподписываемся с нарастающей
+        # задержкой; сообщения, опубликованные за время обрыва, теряются
+        delay = self.reconnect_delay
+        while True:
+            try:
+                if self._pubsub is None:
+                    await self._subscribe()
+                    logger.info("Broker subscription restored")
+                async for raw in self._pubsub.listen():
+                    delay = self.reconnect_delay
+                    self._handle(raw)
+                logger.warning("Broker subscription closed")
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception(
+                    "Broker subscription lost, reconnecting in %.1fs", delay
+                )
+            await self._drop_subscription()
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.reconnect_max_delay)
+
+    def _handle(self, raw: dict) -> None:
+        try:
+            envelope = json.loads(raw["data"])
+            channel = raw["channel"]
+            if isinstance(channel, bytes):
+                channel = channel.decode()
+            if channel == self._broadcast_channel:
+                # Свои служебные сообщения узел уже применил локально
+                if envelope["node_id"] != self.node_id and self.on_broadcast:
+                    self.on_broadcast(envelope["message"])
+                return
+            key = envelope.get("key")
+            self.deliver(
+                envelope["user_ids"],
+                envelope["message"],
+                tuple(key) if isinstance(key, list) else key,
+            )
+        except Exception:
+            logger.exception("Failed to deliver broker message")
+
+    async def _heartbeat(self) -> None:
+        # Продлеваем присутствие своих пользователей; записи упавшего узла истекут
+        while True:
+            await asyncio.sleep(self.presence_ttl / 3)
+            try:
+                async with self.redis.pipeline(transaction=False) as pipe:
+                    for user_id in self.local_users:
+                        pipe.set(
+                            self._presence_key(user_id),
+                            self.node_id,
+                            ex=self.presence_ttl,
+                        )
+                    await pipe.execute()
+            except Exception:
+                logger.exception("Failed to refresh presence")
+
+    async def register(self, user_id: int) -> None:
+        self.local_users.add(user_id)
+        await self.redis.set(
+            self._presence_key(user_id), self.node_id, ex=self.presence_ttl
+        )
+
+    async def unregister(self, user_id: int) -> None:
+        self.local_users.discard(user_id)
+        await self._unregister(keys=[self._presence_key(user_id)], args=[self.node_id])
+
+    async def locate(self, user_ids: list[int]) -> dict[str, list[int]]:
+        if not user_ids:
+            return {}
+        values = await self.redis.mget(
+            [self._presence_key(user_id) for user_id in user_ids]
+        )
+        nodes: dict[str, list[int]] = {}
+        for user_id, node_id in zip(user_ids, values):
+            if node_id is not None:
+                nodes.setdefault(node_id.decode(), []).append(user_id)
+        return nodes
+
+    async def publish(
+        self,
+        node_id: str,
+        user_ids: list[int],
+        message: dict,
+        key: Hashable | None = None,
+    ) -> None:
+        envelope = {"user_ids": user_ids, "message": message, "key": key}
+        await self.redis.publish(self._channel(node_id), json.dumps(envelope))
+
+    async def broadcast(self, message: dict) -> None:
+        envelope = {"node_id": self.node_id, "message": message}
+        await self.redis.publish(self._broadcast_channel, json.dumps(envelope))
+
+
+def create_broker(config: BrokerConfig) -> Broker:
+    node_id = config.node_id or default_node_id()
+    if config.backend == "memory":
+        return InProcessBroker(node_id=node_id)
+    if config.backend == "redis":
+        return RedisBroker(
+            node_id=node_id,
+            url=config.redis_url,
+            presence_ttl=config.presence_ttl,
+            reconnect_delay=config.reconnect_delay,
+            reconnect_max_delay=config.reconnect_max_delay,
+        )
+    raise ValueError(f"Unknown broker backend: {config.backend}")
@@ -1,24 +1,238 @@
-from typing import Dict
-from fastapi import WebSocket
+import asyncio
+import itertools
+import logging
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable
+
+from fastapi import WebSocket, status
 
 from api_v1.usersGeo.schemas import UserGeoUpdate
+from core.config import settings
+from core.metrics import ws_fanout_duration, ws_fanout_recipients
+from .broker import Broker, InProcessBroker, default_node_id
+from .protocol import make_encoder
+
+logger = logging.getLogger(__name__)
+
+
+class OutboundQueue:
+    """Очередь исходящих сообщений клиента.
+
+    Сообщение с уже стоящим в очереди ключом заменяет старое на его месте,
+    поэтому устаревшие координаты отправителя никогда не доставляются.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._messages: OrderedDict[Hashable, dict] = OrderedDict()
+        self._ready = asyncio.Event()
+        self._seq = itertools.count()
+        self.coalesced = 0
+
+    def __len__(self) -> int:
+        return len(self._messages)
+
+    def put(self, message: dict, key: Hashable | None = None) -> bool:
+        if key is None:
+            key = ("seq", next(self._seq))
+        elif key in self._messages:
+            self._messages[key] = message
+            self.coalesced += 1
+            return True
+        if len(self._messages) >= self.maxsize:
+            return False
+        self._messages[key] = message
+        self._ready.set()
+        return True
+
+    async def get(self) -> dict:
+        while not self._messages:
+            self._ready.clear()
+            await self._ready.wait()
+        _, message = self._messages.popitem(last=False)
+        return message
+
+
+class Connection:
+    def __init__(
+        self,
+        user_id: int,
+        websocket: WebSocket,
+        subprotocol: str | None = None,
+    ):
+        self.user_id = user_id
+        self.websocket = websocket
+        self.subprotocol = subprotocol
+        # Кодирование в writer-задаче: дельты считаются от реально отправленного
+        self.encoder = make_encoder(subprotocol)
+        self.queue = OutboundQueue(maxsize=settings.ws.send_queue_size)
+        self.writer: asyncio.Task | None = None
+
+    async def write_loop(self) -> None:
+        while True:
+            frame = self.encoder.encode(await self.queue.get())
+            if isinstance(frame, bytes):
+                send = self.websocket.send_bytes(frame)
+            else:
+                send = self.websocket.send_text(frame)
+            await asyncio.wait_for(send, settings.ws.send_timeout)
 
 
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: Dict[int, WebSocket] = {}
+    def __init__(self, broker: Broker | None = None):
+        self.active_connections: Dict[int, Connection] = {}
+        self.broker = broker or InProcessBroker(node_id=default_node_id())
+        # Обработчики служебных сообщений от других узлов по message["type"]
+        self.broadcast_handlers: dict[str, Callable[[dict], object]] = {}
+        # Задачи отключения переполненных клиентов: держим ссылки, иначе их
+        # может собрать сборщик мусора до завершения
+        self._evictions: set[asyncio.Task] = set()
+
+    async def start(self) -> None:
+        await self.broker.start(deliver=self._deliver, on_broadcast=self._on_broadcast)
+
+    async def stop(self) -> None:
+        if self._evictions:
+            await asyncio.gather(*self._evictions, return_exceptions=True)
+        await self.broker.stop()
+
+    def _deliver(self, user_ids: list[int], message: dict, key: Hashable | None):
+        for user_id in user_ids:
+            self.send(user_id, message, key)
+
+    def _on_broadcast(self, message: dict) -> None:
+        handler = self.broadcast_handlers.get(message.get("type"))
+        if handler is None:
+            logger.warning("Unknown broadcast message type: %s", message.get("type"))
+            return
+        handler(message)
+
+    async def broadcast(self, message: dict) -> None:
+        """Рассылает служебное сообщение остальным воркерам и репликам;
+        на этом узле его применяет сам вызывающий."""
+        await self.broker.broadcast(message)
 
     # Подключение нового пользователя
-    async def connect(self, user_id: int, websocket: WebSocket):
-        self.active_connections[user_id] = websocket
-        await websocket.accept()
-        print("connected ", websocket)
-        print("Active connections ", self.active_connections)
+    async def connect(
+        self,
+        user_id: int,
+        websocket: WebSocket,
+        subprotocol: str | None = None,
+    ):
+        await websocket.accept(subprotocol=subprotocol)
+        connection = Connection(
+            user_id=user_id, websocket=websocket, subprotocol=subprotocol
+        )
+        previous = self.active_connections.get(user_id)
+        self.active_connections[user_id] = connection
+        if previous is not None:
+            await self._close(previous, code=status.WS_1008_POLICY_VIOLATION)
+        connection.writer = asyncio.create_task(self._write(connection))
+        await self.broker.register(user_id)
+        logger.debug(
+            "Websocket connected: user_id=%s subprotocol=%s active=%d",
+            user_id,
+            subprotocol,
+            len(self.active_connections),
+        )
 
     # Отключение пользователя
-    async def disconnect(self, user_id: int):
-        if user_id in self.active_connections:
-            del self.active_connections[user_id]
+    async def disconnect(self, user_id: int, websocket: WebSocket | None = None):
+        connection = self.active_connections.get(user_id)
+        if connection is None:
+            return
+        # Не трогаем более новое подключение того же пользователя
+        if websocket is not None and connection.websocket is not websocket:
+            return
+        del self.active_connections[user_id]
+        if connection.writer is not None:
+            connection.writer.cancel()
+        await self.broker.unregister(user_id)
+        logger.debug(
+            "Websocket disconnected: user_id=%s active=%d",
+            user_id,
+            len(self.active_connections),
+        )
+
+    async def _write(self, connection: Connection) -> None:
+        try:
+            await connection.write_loop()
+        except asyncio.CancelledError:
+            raise
+        except asyncio.TimeoutError:
+            logger.warning("Evicting lagging websocket of user %s", connection.user_id)
+            await self._evict(connection)
+        except Exception as e:
+            logger.info("Websocket of user %s is gone: %s", connection.user_id, e)
+            await self._evict(connection)
+
+    def _forget(self, connection: Connection) -> None:
+        if self.active_connections.get(connection.user_id) is connection:
+            del self.active_connections[connection.user_id]
+
+    async def _close(self, connection: Connection, code: int) -> None:
+        if connection.writer is not None:
+            connection.writer.cancel()
+        try:
+            await connection.websocket.close(code=code)
+        except Exception:
+            pass
+
+    async def _evict(self, connection: Connection) -> None:
+        self._forget(connection)
+        try:
+            await connection.websocket.close(code=status.WS_1013_TRY_AGAIN_LATER)
+        except Exception:
+            pass
+        if connection.user_id not in self.active_connections:
+            await self.broker.unregister(connection.user_id)
+
+    def send(self, user_id: int, message: dict, key: Hashable | None = None) -> bool:
+        """Ставит сообщение в очередь получателя, не дожидаясь сети."""
+        connection = self.active_connections.get(user_id)
+        if connection is None:
+            return False
+        if connection.queue.put(message, key):
+            return True
+        # Очередь переполнена: клиент не успевает читать
+        logger.warning("Evicting websocket of user %s: send queue is full", user_id)
+        self._forget(connection)
+        if connection.writer is not None:
+            connection.writer.cancel()
+        task = asyncio.create_task(self._evict(connection))
+        self._evictions.add(task)
+        task.add_done_callback(self._eviction_done)
+        return False
+
+    def _eviction_done(self, task: asyncio.Task) -> None:
+        self._evictions.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Failed to evict websocket", exc_info=task.exception())
+
+    async def send_to_users(
+        self,
+        user_ids: list[int],
+        message: dict,
+        key: Hashable | None = None,
+    ) -> None:
+        """Локальным получателям ставит сообщение в очередь, остальным
+        пересылает через брокер одним сообщением на узел."""
+        remote = []
+        for user_id in user_ids:
+            if user_id in self.active_connections:
+                self.send(user_id, message, key)
+            else:
+                remote.append(user_id)
+        if not remote:
+            return
+        try:
+            nodes = await self.broker.locate(remote)
+            for node_id, node_user_ids in nodes.items():
+                if node_id != self.broker.node_id:
+                    await self.broker.publish(node_id, node_user_ids, message, key)
+        except Exception:
+            logger.exception("Failed to route message through broker")
 
     async def send_new_user_geo_to_friends(
         self,
@@ -26,17 +240,12 @@ class ConnectionManager:
         geo_data: UserGeoUpdate,
         user_id: int,
     ):
-        for friend_id in friends_ids:
-            if friend_id in self.active_connections:
-                try:
-                    print("sending message to:", friend_id)
-                    websocket = self.active_connections[friend_id]
-                    await websocket.send_json(
-                        {
-                            "action": "update_friend_geo",
-                            "user_id": user_id,
-                            "geo": geo_data.model_dump(),
-                        }
-                    )
-                except Exception as e:
-                    print(f"Ошибка отправки геоданных для друга {friend_id}: {e}")
+        message = {
+            "action": "update_friend_geo",
+            "user_id": user_id,
+            "geo": {"latitude": geo_data.latitude, "longitude": geo_data.longitude},
+        }
+        started = time.perf_counter()
+        await self.send_to_users(friends_ids, message, key=("geo", user_id))
+        ws_fanout_duration.observe(time.perf_counter() - started)
+        ws_fanout_recipients.observe(len(friends_ids))
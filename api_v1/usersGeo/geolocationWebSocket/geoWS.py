@@ -1,20 +1,61 @@
+import json
+import logging
+from datetime import datetime
+
 from fastapi import APIRouter, Depends
 from fastapi import WebSocket, WebSocketDisconnect
-from sqlalchemy.ext.asyncio import AsyncSession
+from api_v1.auth import decode_access_token
+from api_v1.events.changes import event_changes
+from api_v1.events.crud import event_payload, events_in_area
+from api_v1.events.schemas import EventsInArea
+from core.users_service import (
+    UsersServiceClient,
+    UsersServiceUnavailable,
+    get_users_service,
+)
 from core.config import settings
+from core.metrics import registry, ws_connects, ws_disconnects, ws_messages
+from .broker import create_broker
 from .connectionManager import ConnectionManager
+from .geofence import geofences
+from .viewport import viewports
+from .protocol import BinaryDecoder, negotiate_subprotocol, parse_geo
+from .throttle import update_throttle
 from core.models import db_helper
-from api_v1.usersGeo.crud import (
-    update_or_create_user_geo,
-    get_users_geo,
-    get_users_friends_geo,
-    get_friend_list,
-)
+from api_v1.usersGeo.crud import get_friend_list, invalidate_friend_lists
+from api_v1.usersGeo.geoWriter import geo_writer, history_writer
 from api_v1.usersGeo.schemas import UserGeoUpdate
+from api_v1.usersGeo.spatialIndex import users_geo_index
 from fastapi import status, HTTPException
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter(tags=["ws"])
-manager = ConnectionManager()
+manager = ConnectionManager(broker=create_broker(settings.broker))
+registry.gauge(
+    "ws_active_connections",
+    "Open WebSocket connections on this worker",
+    lambda: len(manager.active_connections),
+)
+# Неизвестные действия считаем под одной меткой, чтобы клиент не плодил серии
+WS_ACTIONS = ("update_geo", "subscribe_viewport", "unsubscribe_viewport")
+# Переходы геозон и разницы областей уходят в сокеты этого воркера: состояние
+# подписок ведётся там, где подключён пользователь
+geofences.notify = manager.send
+viewports.notify = manager.send
+if settings.geofence.enabled:
+    event_changes.subscribe(geofences)
+event_changes.subscribe(viewports)
+# Сброс списков друзей, пришедший на другой воркер: иначе позиции продолжат
+# уходить бывшим друзьям, пока не истечёт TTL кэша
+FRIEND_LISTS_INVALIDATED = "friend_lists_invalidated"
+
+
+def on_friend_lists_invalidated(message: dict) -> None:
+    invalidate_friend_lists(message["user_ids"])
+
+
+manager.broadcast_handlers[FRIEND_LISTS_INVALIDATED] = on_friend_lists_invalidated
 
 
 @router.get("/kakish")
@@ -22,35 +63,152 @@ async def get_kakish():
     return {"message": "kakish"}
 
 
+class GeoSession:
+    """Состояние одного WebSocket-подключения."""
+
+    def __init__(self, user_id: int, token: str, users_client: UsersServiceClient):
+        self.user_id = user_id
+        self.token = token
+        self.users_client = users_client
+        self.decoder = BinaryDecoder()
+
+    def refresh_token(self, token: str | None) -> None:
+        # Клиент может прислать обновлённый токен того же пользователя
+        if not token or token == self.token:
+            return
+        try:
+            if int(decode_access_token(token)) == self.user_id:
+                self.token = token
+        except ValueError:
+            pass
+
+    async def update_geo(self, latitude: float, longitude: float) -> None:
+        user_id = self.user_id
+        if not update_throttle.accept(user_id, latitude, longitude):
+            return
+        # Запись в БД откладывается, рассылка друзьям её не ждёт
+        received_at = datetime.now()
+        geo_writer.add(user_id, latitude, longitude, received_at)
+        if settings.history.enabled:
+            history_writer.add(user_id, latitude, longitude, received_at)
+        users_geo_index.update(user_id, latitude, longitude, received_at)
+        if settings.geofence.enabled:
+            geofences.evaluate(user_id, latitude, longitude)
+        try:
+            users_friends = await get_friend_list(
+                token=self.token, users_client=self.users_client, user_id=user_id
+            )
+        except UsersServiceUnavailable as e:
+            # Сервис пользователей недоступен: позиция сохранена, рассылку пропускаем
+            logger.warning("Friend list unavailable for %s: %s", user_id, e)
+            return
+        except HTTPException as e:
+            self.send_error(e.detail, e.status_code)
+            return
+        await manager.send_new_user_geo_to_friends(
+            user_id=user_id,
+            friends_ids=users_friends,
+            geo_data=UserGeoUpdate.model_construct(
+                latitude=latitude, longitude=longitude
+            ),
+        )
+
+    async def subscribe_viewport(self, viewport: dict) -> None:
+        area = EventsInArea.model_validate(
+            {**viewport, "after_id": None, "limit": settings.viewport.max_events}
+        )
+        async with db_helper.session_factory() as session:
+            events = await events_in_area(session=session, area=area)
+        diff = viewports.subscribe(
+            self.user_id,
+            (
+                area.min_latitude,
+                area.max_latitude,
+                area.min_longitude,
+                area.max_longitude,
+            ),
+            [event_payload(event) for event in events],
+        )
+        # Событий в области больше, чем отдаём: клиенту стоит приблизить карту
+        diff["truncated"] = len(events) >= area.limit
+        manager.send(self.user_id, diff)
+
+    def send_error(self, detail: str, status_code: int) -> None:
+        manager.send(self.user_id, {"error": detail, "status_code": status_code})
+
+
 @router.websocket("/ws")
 async def websocket_endpoint(
     websocket: WebSocket,
-    user_id: int,
-    session: AsyncSession = Depends(db_helper.session_dependency),
-    user_service_url: str = settings.user_service_url,
+    token: str,
+    users_client: UsersServiceClient = Depends(get_users_service),
 ):
-    # Присоединение нового пользователя
-    await manager.connect(user_id=user_id, websocket=websocket)
+    # Токен проверяется один раз при подключении; user_id берётся только из него
+    try:
+        user_id = int(decode_access_token(token))
+    except ValueError:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    # Присоединение нового пользователя. Подпротокол geo.bin.v1 включает
+    # бинарные кадры для геопозиций, geo.json.v1 (или без подпротокола) — JSON
+    subprotocol = negotiate_subprotocol(websocket.scope.get("subprotocols", []))
+    await manager.connect(user_id=user_id, websocket=websocket, subprotocol=subprotocol)
+    geo_session = GeoSession(user_id=user_id, token=token, users_client=users_client)
+    ws_connects.inc()
 
     try:
         while True:
-            data = await websocket.receive_json()
-            print("got message", data)
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+
+            if message.get("bytes") is not None:
+                ws_messages.inc("update_geo")
+                try:
+                    latitude, longitude = geo_session.decoder.decode_update_geo(
+                        message["bytes"]
+                    )
+                except ValueError as e:
+                    geo_session.send_error(str(e), status.HTTP_400_BAD_REQUEST)
+                    continue
+                await geo_session.update_geo(latitude, longitude)
+                continue
+
+            try:
+                data = json.loads(message["text"])
+            except ValueError:
+                geo_session.send_error("Invalid JSON", status.HTTP_400_BAD_REQUEST)
+                continue
+            if not isinstance(data, dict):
+                geo_session.send_error(
+                    "Message must be a JSON object", status.HTTP_400_BAD_REQUEST
+                )
+                continue
             action = data.get("action")
+            ws_messages.inc(action if action in WS_ACTIONS else "unknown")
+            logger.debug("Websocket message: user_id=%s action=%s", user_id, action)
+            geo_session.refresh_token(data.get("token"))
 
             if action == "update_geo":
-                geo_data = UserGeoUpdate(**data["geo"])
-                await update_or_create_user_geo(user_id, geo_data, session)
-                token = data.get("token")
-                users_friends = await get_friend_list(
-                    token=token, user_service_url=user_service_url
-                )
-                await manager.send_new_user_geo_to_friends(
-                    user_id=user_id,
-                    friends_ids=users_friends,
-                    geo_data=geo_data,
-                )
-                await session.close()
+                try:
+                    latitude, longitude = parse_geo(
+                        data["geo"]["latitude"], data["geo"]["longitude"]
+                    )
+                except (KeyError, TypeError, ValueError) as e:
+                    geo_session.send_error(str(e), status.HTTP_400_BAD_REQUEST)
+                    continue
+                await geo_session.update_geo(latitude, longitude)
+
+            elif action == "subscribe_viewport":
+                # Ответ и дальнейшие изменения приходят сообщениями viewport_diff
+                try:
+                    await geo_session.subscribe_viewport(data["viewport"])
+                except (KeyError, TypeError, ValueError) as e:
+                    geo_session.send_error(str(e), status.HTTP_400_BAD_REQUEST)
+
+            elif action == "unsubscribe_viewport":
+                viewports.unsubscribe(user_id)
 
         # elif action == "get_user_geos":
         #     # Получаем ID пользователей, чьи геоданные нужны
@@ -58,7 +216,7 @@ async def websocket_endpoint(
         #     try:
         #         friends_geos = await get_users_friends_geo(
         #             session=session,
-        #             user_service_url=user_service_url,
+        #             users_client=users_client,
         #             token=token,
         #         )
         #         await websocket.send_json(
@@ -71,5 +229,12 @@ async def websocket_endpoint(
         #         )
 
     except WebSocketDisconnect:
+        pass
+    finally:
+        ws_disconnects.inc()
         # Обрабатываем отключение клиента
-        await manager.disconnect(user_id=user_id)
+        await manager.disconnect(user_id=user_id, websocket=websocket)
+        if user_id not in manager.active_connections:
+            update_throttle.forget(user_id)
+            geofences.forget(user_id)
+            viewports.unsubscribe(user_id)
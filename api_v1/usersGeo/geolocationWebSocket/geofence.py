@@ -0,0 +1,105 @@
+from typing import Callable, Hashable
+
+from api_v1.usersGeo.spatialIndex import SpatialGridIndex
+from core.config import settings
+
+# Отправка сообщения пользователю: (user_id, message, key)
+Notify = Callable[[int, dict, Hashable | None], object]
+
+
+class GeofenceEngine:
+    """Геозоны вокруг событий: круг radius метров с центром в точке события.
+
+    Центры событий лежат в SpatialGridIndex, поэтому проверка точки
+    просматривает только соседние ячейки сетки. Для каждого пользователя
+    хранится набор зон, в которых он находится, и наружу уходят только
+    переходы enter/exit. Выход засчитывается за radius * exit_factor, чтобы
+    дрожание GPS на границе не порождало поток enter/exit.
+    """
+
+    def __init__(self, radius: float, exit_factor: float, cell_size: float):
+        self.radius = radius
+        self.exit_radius = radius * exit_factor
+        self.events = SpatialGridIndex(cell_size=cell_size)
+        self.inside: dict[int, set[int]] = {}
+        self.members: dict[int, set[int]] = {}
+        self.notify: Notify | None = None
+
+    def evaluate(
+        self,
+        user_id: int,
+        latitude: float,
+        longitude: float,
+    ) -> tuple[list[int], list[int]]:
+        """Обновляет состояние пользователя, возвращает (вошёл, вышел)."""
+        previous = self.inside.get(user_id, set())
+        current = set()
+        for event_id, distance in self.events.within(
+            latitude, longitude, self.exit_radius
+        ):
+            if distance <= self.radius or event_id in previous:
+                current.add(event_id)
+        entered = [event_id for event_id in current if event_id not in previous]
+        exited = [event_id for event_id in previous if event_id not in current]
+        for event_id in entered:
+            self.members.setdefault(event_id, set()).add(user_id)
+        for event_id in exited:
+            self._leave(event_id, user_id)
+        if current:
+            self.inside[user_id] = current
+        else:
+            self.inside.pop(user_id, None)
+        self._send(user_id, "enter", entered)
+        self._send(user_id, "exit", exited)
+        return entered, exited
+
+    def forget(self, user_id: int) -> None:
+        for event_id in self.inside.pop(user_id, ()):
+            self._leave(event_id, user_id)
+
+    def upsert_event(self, event_id: int, latitude: float, longitude: float) -> None:
+        # Пользователи внутри переехавшей зоны получат exit со следующей точкой
+        self.events.update(event_id, latitude, longitude)
+
+    def event_changed(self, event: dict, previous: tuple[float, float] | None):
+        self.upsert_event(event["id"], event["latitude"], event["longitude"])
+
+    def event_removed(self, event_id: int, previous: tuple[float, float] | None):
+        self.remove_event(event_id)
+
+    def remove_event(self, event_id: int) -> None:
+        self.events.remove(event_id)
+        for user_id in self.members.pop(event_id, ()):
+            inside = self.inside.get(user_id)
+            if inside is not None:
+                inside.discard(event_id)
+                if not inside:
+                    del self.inside[user_id]
+            self._send(user_id, "exit", [event_id])
+
+    def _leave(self, event_id: int, user_id: int) -> None:
+        members = self.members.get(event_id)
+        if members is not None:
+            members.discard(user_id)
+            if not members:
+                del self.members[event_id]
+
+    def _send(self, user_id: int, transition: str, event_ids: list[int]) -> None:
+        if self.notify is None:
+            return
+        for event_id in event_ids:
+            self.notify(
+                user_id,
+                {"action": "geofence", "transition": transition, "event_id": event_id},
+                None,
+            )
+
+    def stats(self) -> dict:
+        return {"events": len(self.events), "users_inside": len(self.inside)}
+
+
+geofences = GeofenceEngine(
+    radius=settings.geofence.radius,
+    exit_factor=settings.geofence.exit_factor,
+    cell_size=settings.geo_index.cell_size,
+)
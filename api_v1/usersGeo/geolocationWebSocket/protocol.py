@@ -0,0 +1,103 @@
+import json
+import struct
+
+JSON_SUBPROTOCOL = "geo.json.v1"
+BINARY_SUBPROTOCOL = "geo.bin.v1"
+
+# Координаты передаются целыми в миллионных долях градуса (~11 см)
+SCALE = 1_000_000
+
+# Бинарные кадры (network byte order):
+#   update_geo         клиент -> сервер  !BBii   type, flags, lat, lon
+#   update_geo (delta)                   !BBhh   type, flags, dlat, dlon
+#   update_friend_geo  сервер -> клиент  !BBIii  type, flags, user_id, lat, lon
+#   update_friend_geo (delta)            !BBIhh  type, flags, user_id, dlat, dlon
+# Дельта считается от последней точки, переданной в том же направлении
+# (для update_friend_geo — от последней точки того же друга)
+FRAME_UPDATE_GEO = 1
+FRAME_FRIEND_GEO = 2
+FLAG_DELTA = 0x01
+
+_UPDATE_GEO = struct.Struct("!BBii")
+_UPDATE_GEO_DELTA = struct.Struct("!BBhh")
+_FRIEND_GEO = struct.Struct("!BBIii")
+_FRIEND_GEO_DELTA = struct.Struct("!BBIhh")
+_INT16 = range(-32768, 32768)
+
+
+def negotiate_subprotocol(requested: list[str]) -> str | None:
+    for subprotocol in (BINARY_SUBPROTOCOL, JSON_SUBPROTOCOL):
+        if subprotocol in requested:
+            return subprotocol
+    return None
+
+
+def parse_geo(latitude, longitude) -> tuple[float, float]:
+    # Валидация без pydantic: это горячий путь. NaN не проходит сравнения
+    latitude = float(latitude)
+    longitude = float(longitude)
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise ValueError("Coordinates out of range")
+    return latitude, longitude
+
+
+class BinaryDecoder:
+    """Разбор бинарных update_geo одного соединения."""
+
+    def __init__(self):
+        self.last: tuple[int, int] | None = None
+
+    def decode_update_geo(self, frame: bytes) -> tuple[float, float]:
+        if len(frame) < 2 or frame[0] != FRAME_UPDATE_GEO:
+            raise ValueError("Unknown frame")
+        if frame[1] & FLAG_DELTA:
+            if self.last is None or len(frame) != _UPDATE_GEO_DELTA.size:
+                raise ValueError("Malformed delta frame")
+            _, _, d_lat, d_lon = _UPDATE_GEO_DELTA.unpack(frame)
+            lat, lon = self.last[0] + d_lat, self.last[1] + d_lon
+        else:
+            if len(frame) != _UPDATE_GEO.size:
+                raise ValueError("Malformed frame")
+            _, _, lat, lon = _UPDATE_GEO.unpack(frame)
+        latitude, longitude = parse_geo(lat / SCALE, lon / SCALE)
+        self.last = (lat, lon)
+        return latitude, longitude
+
+
+class BinaryEncoder:
+    """Кодирование исходящих сообщений одного соединения.
+
+    Позиции друзей упаковываются в бинарные кадры, остальные сообщения
+    уходят текстовым JSON.
+    """
+
+    def __init__(self):
+        self.last_sent: dict[int, tuple[int, int]] = {}
+
+    def encode(self, message: dict) -> bytes | str:
+        if message.get("action") != "update_friend_geo":
+            return json.dumps(message)
+        user_id = message["user_id"]
+        geo = message["geo"]
+        lat = round(geo["latitude"] * SCALE)
+        lon = round(geo["longitude"] * SCALE)
+        last = self.last_sent.get(user_id)
+        self.last_sent[user_id] = (lat, lon)
+        if last is not None:
+            d_lat, d_lon = lat - last[0], lon - last[1]
+            if d_lat in _INT16 and d_lon in _INT16:
+                return _FRIEND_GEO_DELTA.pack(
+                    FRAME_FRIEND_GEO, FLAG_DELTA, user_id, d_lat, d_lon
+                )
+        return _FRIEND_GEO.pack(FRAME_FRIEND_GEO, 0, user_id, lat, lon)
+
+
+class JsonEncoder:
+    def encode(self, message: dict) -> str:
+        return json.dumps(message)
+
+
+def make_encoder(subprotocol: str | None) -> BinaryEncoder | JsonEncoder:
+    if subprotocol == BINARY_SUBPROTOCOL:
+        return BinaryEncoder()
+    return JsonEncoder()
@@ -0,0 +1,60 @@
+import time
+
+from api_v1.usersGeo.spatialIndex import distance_sphere
+from core.config import settings
+
+
+class UpdateThrottle:
+    """Отбрасывает избыточные геопозиции до записи в БД и рассылки.
+
+    Точка пропускается, если пришла раньше min_interval после предыдущей
+    принятой или сдвинулась меньше чем на min_distance метров. Раз в
+    force_refresh секунд точка принимается в любом случае.
+    """
+
+    def __init__(self, min_distance: float, min_interval: float, force_refresh: float):
+        self.min_distance = min_distance
+        self.min_interval = min_interval
+        self.force_refresh = force_refresh
+        self._last: dict[int, tuple[float, float, float]] = {}
+        self.accepted = 0
+        self.suppressed_interval = 0
+        self.suppressed_distance = 0
+
+    def accept(self, user_id: int, latitude: float, longitude: float) -> bool:
+        now = time.monotonic()
+        last = self._last.get(user_id)
+        if last is not None:
+            last_latitude, last_longitude, accepted_at = last
+            elapsed = now - accepted_at
+            if elapsed < self.force_refresh:
+                if elapsed < self.min_interval:
+                    self.suppressed_interval += 1
+                    return False
+                distance = distance_sphere(
+                    last_latitude, last_longitude, latitude, longitude
+                )
+                if distance < self.min_distance:
+                    self.suppressed_distance += 1
+                    return False
+        self._last[user_id] = (latitude, longitude, now)
+        self.accepted += 1
+        return True
+
+    def forget(self, user_id: int) -> None:
+        self._last.pop(user_id, None)
+
+    def stats(self) -> dict:
+        return {
+            "accepted": self.accepted,
+            "suppressed": self.suppressed_interval + self.suppressed_distance,
+            "suppressed_interval": self.suppressed_interval,
+            "suppressed_distance": self.suppressed_distance,
+        }
+
+
+update_throttle = UpdateThrottle(
+    min_distance=settings.ws.min_distance,
+    min_interval=settings.ws.min_interval_ms / 1000,
+    force_refresh=settings.ws.force_refresh,
+)
@@ -0,0 +1,153 @@
+import math
+from collections import defaultdict
+from datetime import datetime
+from typing import Callable, Hashable
+
+from core.config import settings
+
+# Отправка сообщения пользователю: (user_id, message, key)
+Notify = Callable[[int, dict, Hashable | None], object]
+
+# (min_latitude, max_latitude, min_longitude, max_longitude)
+Box = tuple[float, float, float, float]
+
+
+def contains(box: Box, latitude: float, longitude: float) -> bool:
+    return box[0] <= latitude <= box[1] and box[2] <= longitude <= box[3]
+
+
+def wire_event(event: dict) -> dict:
+    return {**event, "updated_at": event["updated_at"].isoformat()}
+
+
+class ViewportSubscriptions:
+    """Подписки на область карты: клиент получает только разницу
+    (added / updated / removed) с тем, что у него уже есть.
+
+    Для каждого пользователя хранится область и версии (updated_at) событий,
+    отправленных клиенту. Области разложены по ячейкам грубой сетки, поэтому
+    изменение события проверяется только у подписчиков, чьи области покрывают
+    его старую или новую точку. Слишком большие области лежат отдельным
+    списком и проверяются на каждое изменение.
+    """
+
+    def __init__(self, cell_size: float, max_cells: int):
+        self.cell_size = cell_size
+        self.max_cells = max_cells
+        self.boxes: dict[int, Box] = {}
+        self.known: dict[int, dict[int, datetime]] = {}
+        self.cells: dict[tuple[int, int], set[int]] = defaultdict(set)
+        self.wide: set[int] = set()
+        self.notify: Notify | None = None
+
+    def __len__(self) -> int:
+        return len(self.boxes)
+
+    def _cell(self, latitude: float, longitude: float) -> tuple[int, int]:
+        return (
+            math.floor(latitude / self.cell_size),
+            math.floor(longitude / self.cell_size),
+        )
+
+    def _box_cells(self, box: Box) -> list[tuple[int, int]] | None:
+        min_i, min_j = self._cell(box[0], box[2])
+        max_i, max_j = self._cell(box[1], box[3])
+        if (max_i - min_i + 1) * (max_j - min_j + 1) > self.max_cells:
+            return None
+        return [
+            (i, j) for i in range(min_i, max_i + 1) for j in range(min_j, max_j + 1)
+        ]
+
+    def _register(self, user_id: int, box: Box) -> None:
+        cells = self._box_cells(box)
+        if cells is None:
+            self.wide.add(user_id)
+            return
+        for cell in cells:
+            self.cells[cell].add(user_id)
+
+    def _unregister(self, user_id: int, box: Box) -> None:
+        cells = self._box_cells(box)
+        if cells is None:
+            self.wide.discard(user_id)
+            return
+        for cell in cells:
+            bucket = self.cells.get(cell)
+            if bucket is not None:
+                bucket.discard(user_id)
+                if not bucket:
+                    del self.cells[cell]
+
+    def subscribe(self, user_id: int, box: Box, events: list[dict]) -> dict:
+        """Меняет область пользователя; events — все события в новой области.
+        Возвращает разницу с тем, что клиент уже получил."""
+        old_box = self.boxes.get(user_id)
+        if old_box is not None:
+            self._unregister(user_id, old_box)
+        self.boxes[user_id] = box
+        self._register(user_id, box)
+
+        known = self.known.get(user_id, {})
+        current = {event["id"]: event["updated_at"] for event in events}
+        self.known[user_id] = current
+        return {
+            "action": "viewport_diff",
+            "added": [wire_event(e) for e in events if e["id"] not in known],
+            "updated": [
+                wire_event(e)
+                for e in events
+                if e["id"] in known and known[e["id"]] != e["updated_at"]
+            ],
+            "removed": [event_id for event_id in known if event_id not in current],
+        }
+
+    def unsubscribe(self, user_id: int) -> None:
+        box = self.boxes.pop(user_id, None)
+        if box is not None:
+            self._unregister(user_id, box)
+        self.known.pop(user_id, None)
+
+    def _candidates(self, *points: tuple[float, float] | None) -> set[int]:
+        candidates = set(self.wide)
+        for point in points:
+            if point is not None:
+                candidates |= self.cells.get(self._cell(*point), set())
+        return candidates
+
+    def event_changed(self, event: dict, previous: tuple[float, float] | None):
+        event_id = event["id"]
+        point = (event["latitude"], event["longitude"])
+        for user_id in self._candidates(point, previous):
+            known = self.known[user_id]
+            if contains(self.boxes[user_id], *point):
+                change = "updated" if event_id in known else "added"
+                known[event_id] = event["updated_at"]
+                self._send(user_id, {change: [wire_event(event)]})
+            elif known.pop(event_id, None) is not None:
+                # Событие уехало из области
+                self._send(user_id, {"removed": [event_id]})
+
+    def event_removed(self, event_id: int, previous: tuple[float, float] | None):
+        for user_id in self._candidates(previous):
+            if self.known[user_id].pop(event_id, None) is not None:
+                self._send(user_id, {"removed": [event_id]})
+
+    def _send(self, user_id: int, diff: dict) -> None:
+        if self.notify is not None:
+            message = {"action": "viewport_diff", "added": [], "updated": []}
+            message["removed"] = []
+            # Разницы накапливаются у клиента, поэтому не склеиваются в очереди
+            self.notify(user_id, {**message, **diff}, None)
+
+    def stats(self) -> dict:
+        return {
+            "subscribers": len(self.boxes),
+            "cells": len(self.cells),
+            "wide": len(self.wide),
+        }
+
+
+viewports = ViewportSubscriptions(
+    cell_size=settings.viewport.cell_size,
+    max_cells=settings.viewport.max_cells,
+)
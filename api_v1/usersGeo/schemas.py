@@ -18,3 +18,7 @@ class UserGeo(UserGeoUpdate):
 class UserGeoResponce(UserGeo):
     model_config = ConfigDict(from_attributes=True)
     pass
+
+
+class FriendListsInvalidate(BaseModel):
+    user_ids: list[int]
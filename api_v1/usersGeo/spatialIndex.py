@@ -0,0 +1,229 @@
+import math
+from collections import defaultdict
+from datetime import datetime
+
+from core.config import settings
+
+# Радиус, который использует ST_DistanceSphere в PostGIS
+EARTH_RADIUS = 6370986.0
+METERS_PER_DEGREE = math.pi * EARTH_RADIUS / 180
+
+
+def distance_sphere(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lon2 - lon1)
+    a = (
+        math.sin(d_phi / 2) ** 2
+        + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+
+class SpatialGridIndex:
+    """Равномерная сетка по широте/долготе: точки раскладываются по ячейкам,
+    запросы по радиусу и k ближайших просматривают только соседние ячейки."""
+
+    def __init__(self, cell_size: float = 0.05):
+        self.cell_size = cell_size
+        self.points: dict[int, tuple[float, float]] = {}
+        self.stamps: dict[int, datetime] = {}
+        self.cells: dict[tuple[int, int], set[int]] = defaultdict(set)
+
+    def __len__(self) -> int:
+        return len(self.points)
+
+    def __contains__(self, key: int) -> bool:
+        return key in self.points
+
+    def _cell(self, latitude: float, longitude: float) -> tuple[int, int]:
+        return (
+            math.floor(latitude / self.cell_size),
+            math.floor(longitude / self.cell_size),
+        )
+
+    def get(self, key: int) -> tuple[float, float] | None:
+        return self.points.get(key)
+
+    def update(
+        self,
+        key: int,
+        latitude: float,
+        longitude: float,
+        stamp: datetime | None = None,
+    ) -> None:
+        # Более старая точка (например, из синхронизации с БД) не затирает свежую
+        if stamp is not None:
+            current = self.stamps.get(key)
+            if current is not None and current > stamp:
+                return
+            self.stamps[key] = stamp
+        old = self.points.get(key)
+        cell = self._cell(latitude, longitude)
+        if old is not None:
+            old_cell = self._cell(*old)
+            if old_cell != cell:
+                self._discard(old_cell, key)
+        self.points[key] = (latitude, longitude)
+        self.cells[cell].add(key)
+
+    def remove(self, key: int) -> None:
+        old = self.points.pop(key, None)
+        self.stamps.pop(key, None)
+        if old is not None:
+            self._discard(self._cell(*old), key)
+
+    def clear(self) -> None:
+        self.points.clear()
+        self.stamps.clear()
+        self.cells.clear()
+
+    def _discard(self, cell: tuple[int, int], key: int) -> None:
+        bucket = self.cells.get(cell)
+        if bucket is not None:
+            bucket.discard(key)
+            if not bucket:
+                del self.cells[cell]
+
+    def _columns(self, j: int) -> tuple[int, ...]:
+        """Столбцы сетки, которые покрывает столбец j: часть столбца за ±180°
+        переносится на другой край, сетка замыкается по антимеридиану."""
+        west = j * self.cell_size
+        east = west + self.cell_size
+        if -180 <= west and east <= 180:
+            return (j,)
+        first = math.floor(-180 / self.cell_size)
+        last = math.floor(180 / self.cell_size)
+        columns = {j} if west <= 180 and east > -180 else set()
+        if east > 180:
+            columns.update(
+                range(
+                    math.floor((max(west, 180) - 360) / self.cell_size),
+                    math.floor((east - 360) / self.cell_size) + 1,
+                )
+            )
+        if west < -180:
+            columns.update(
+                range(
+                    math.floor((west + 360) / self.cell_size),
+                    math.floor((min(east, -180) + 360) / self.cell_size) + 1,
+                )
+            )
+        return tuple(column for column in columns if first <= column <= last)
+
+    def _lon_columns(self, start: int, stop: int) -> list[int]:
+        return sorted(
+            {column for j in range(start, stop + 1) for column in self._columns(j)}
+        )
+
+    def _cell_span(self, latitude: float, radius: float) -> tuple[int, int]:
+        lat_cells = math.ceil(radius / METERS_PER_DEGREE / self.cell_size)
+        cos_lat = math.cos(
+            math.radians(min(abs(latitude) + lat_cells * self.cell_size, 89.9))
+        )
+        lon_cells = math.ceil(radius / (METERS_PER_DEGREE * cos_lat) / self.cell_size)
+        # Не обходим больше ячеек, чем помещается по долготе на всём круге
+        lon_cells = min(lon_cells, math.ceil(180 / self.cell_size))
+        return lat_cells, lon_cells
+
+    def _scan(
+        self,
+        latitude: float,
+        longitude: float,
+        lat_range: range,
+        lon_range: range,
+        exclude: int | None,
+    ):
+        for i in lat_range:
+            for j in lon_range:
+                bucket = self.cells.get((i, j))
+                if not bucket:
+                    continue
+                for key in bucket:
+                    if key == exclude:
+                        continue
+                    lat, lon = self.points[key]
+                    yield key, distance_sphere(latitude, longitude, lat, lon)
+
+    def within(
+        self,
+        latitude: float,
+        longitude: float,
+        radius: float,
+        limit: int | None = None,
+        exclude: int | None = None,
+    ) -> list[tuple[int, float]]:
+        ci, cj = self._cell(latitude, longitude)
+        lat_cells, lon_cells = self._cell_span(latitude, radius)
+        if (2 * lat_cells + 1) * (2 * lon_cells + 1) > len(self.points):
+            candidates = (
+                (key, distance_sphere(latitude, longitude, lat, lon))
+                for key, (lat, lon) in self.points.items()
+                if key != exclude
+            )
+        else:
+            candidates = self._scan(
+                latitude,
+                longitude,
+                range(ci - lat_cells, ci + lat_cells + 1),
+                self._lon_columns(cj - lon_cells, cj + lon_cells),
+                exclude,
+            )
+        found = [(key, distance) for key, distance in candidates if distance <= radius]
+        found.sort(key=lambda item: item[1])
+        return found[:limit] if limit is not None else found
+
+    def nearest(
+        self,
+        latitude: float,
+        longitude: float,
+        k: int,
+        max_distance: float | None = None,
+        exclude: int | None = None,
+    ) -> list[tuple[int, float]]:
+        if max_distance is not None:
+            return self.within(latitude, longitude, max_distance, k, exclude)
+
+        # Расширяем кольца ячеек, пока k-й найденный сосед не окажется ближе,
+        # чем любая точка за пределами уже просмотренного квадрата.
+        # Если ячеек приходится обходить больше, чем есть точек, проще перебрать все
+        ci, cj = self._cell(latitude, longitude)
+        found: list[tuple[int, float]] = []
+        # За антимеридианом кольца могут снова зайти в уже просмотренные ячейки
+        scanned: set[tuple[int, int]] = set()
+        ring = 0
+        while (2 * ring + 1) ** 2 <= len(self.points):
+            for i in range(ci - ring, ci + ring + 1):
+                if i in (ci - ring, ci + ring):
+                    lon_cells = range(cj - ring, cj + ring + 1)
+                else:
+                    lon_cells = (cj - ring, cj + ring)
+                for j in lon_cells:
+                    for column in self._columns(j):
+                        if (i, column) in scanned:
+                            continue
+                        scanned.add((i, column))
+                        found.extend(
+                            self._scan(latitude, longitude, (i,), (column,), exclude)
+                        )
+            if len(found) >= k:
+                found.sort(key=lambda item: item[1])
+                cos_lat = math.cos(
+                    math.radians(min(abs(latitude) + (ring + 1) * self.cell_size, 89.9))
+                )
+                covered = ring * self.cell_size * METERS_PER_DEGREE * cos_lat
+                if found[k - 1][1] <= covered:
+                    return found[:k]
+            ring += 1
+
+        found = [
+            (key, distance_sphere(latitude, longitude, lat, lon))
+            for key, (lat, lon) in self.points.items()
+            if key != exclude
+        ]
+        found.sort(key=lambda item: item[1])
+        return found[:k]
+
+
+users_geo_index = SpatialGridIndex(cell_size=settings.geo_index.cell_size)
@@ -1,15 +1,38 @@
+import json
+import logging
+from datetime import datetime
 from typing import List
 
-from fastapi import APIRouter, HTTPException, status, Depends
-from api_v1.auth import decode_access_token
+from fastapi import (
+    APIRouter,
+    HTTPException,
+    status,
+    Depends,
+    Header,
+    Query,
+    Request,
+    Response,
+)
+from api_v1.auth import decode_access_token, get_current_user_id
 from .schemas import UserGeo
 from . import crud
-from .crud import get_users_geo, get_users_friends_geo
-from .schemas import UserGeoUpdate
+from .crud import get_users_geo, get_users_friends_geo, friends_cache
+from .schemas import UserGeoUpdate, FriendListsInvalidate
+from .geolocationWebSocket.geofence import geofences
+from .geolocationWebSocket.geoWS import FRIEND_LISTS_INVALIDATED, manager
+from .geolocationWebSocket.throttle import update_throttle
+from .geolocationWebSocket.viewport import viewports
+from core.config import settings
 from core.models import db_helper
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from core.config import settings
+from core.users_service import (
+    UsersServiceClient,
+    UsersServiceUnavailable,
+    get_users_service,
+)
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(tags=["userGeo"])
 
@@ -27,6 +50,65 @@ async def update_or_create_user_geo(
     )
 
 
+async def read_bulk_items(request: Request) -> list:
+    # JSON-массив целиком или NDJSON построчно по мере чтения тела
+    max_items = settings.geo_bulk.max_items
+    too_large = HTTPException(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        detail=f"At most {max_items} items per request",
+    )
+    content_type = request.headers.get("content-type", "")
+    if not content_type.startswith("application/x-ndjson"):
+        try:
+            items = json.loads(await request.body())
+        except ValueError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid JSON"
+            )
+        if not isinstance(items, list):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Expected a JSON array",
+            )
+        if len(items) > max_items:
+            raise too_large
+        return items
+
+    items = []
+    tail = b""
+    async for chunk in request.stream():
+        lines = (tail + chunk).split(b"\n")
+        tail = lines.pop()
+        for line in lines:
+            if line.strip():
+                items.append(line)
+        if len(items) > max_items:
+            raise too_large
+    if tail.strip():
+        items.append(tail)
+    if len(items) > max_items:
+        raise too_large
+    # Строка, которая не разбирается, получает статус invalid, а не роняет пакет
+    parsed = []
+    for line in items:
+        try:
+            parsed.append(json.loads(line))
+        except ValueError:
+            parsed.append(None)
+    return parsed
+
+
+@router.post("/bulk")
+async def bulk_upsert_users_geo(
+    request: Request,
+    session: AsyncSession = Depends(db_helper.session_dependency),
+):
+    # Элементы: {"user_id", "latitude", "longitude", "timestamp"};
+    # timestamp — ISO 8601 или секунды Unix. Ответ содержит статус каждого элемента
+    items = await read_bulk_items(request)
+    return await crud.bulk_upsert_users_geo(session=session, items=items)
+
+
 @router.post("/", response_model=List[UserGeo])
 async def read_users_geo(
     user_ids: List[int],
@@ -51,21 +133,112 @@ async def read_users_geo(
 @router.get("/friendsGeo")
 async def get_frinds_geo(
     token: str,
-    user_service_url: str = settings.user_service_url,
+    response: Response,
+    since: datetime | None = None,
+    if_none_match: str | None = Header(default=None),
+    users_client: UsersServiceClient = Depends(get_users_service),
     session: AsyncSession = Depends(db_helper.session_dependency),
 ):
-    return await get_users_friends_geo(
-        token=token, session=session, user_service_url=user_service_url
+    # since — вернуть только друзей, сдвинувшихся после этого момента;
+    # при опросе с If-None-Match неизменившиеся позиции отдаются как 304
+    etag, friends_geo = await get_users_friends_geo(
+        token=token,
+        session=session,
+        users_client=users_client,
+        since=since,
+        if_none_match=if_none_match,
     )
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if friends_geo is None:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    response.headers.update(headers)
+    return friends_geo
+
+
+@router.post("/friendsCache/invalidate")
+async def invalidate_friends_cache(invalidate: FriendListsInvalidate):
+    # Вызывается сервисом пользователей при изменении дружбы
+    invalidated = crud.invalidate_friend_lists(invalidate.user_ids)
+    try:
+        await manager.broadcast(
+            {"type": FRIEND_LISTS_INVALIDATED, "user_ids": invalidate.user_ids}
+        )
+    except Exception:
+        # Остальные узлы сбросят кэш только по TTL: пусть вызывающий повторит
+        logger.exception("Failed to broadcast friend list invalidation")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Broker unavailable",
+        )
+    return {"invalidated": invalidated}
+
+
+@router.get("/stats")
+async def get_stats():
+    return {
+        "friends_cache": friends_cache.stats(),
+        "ws_updates": update_throttle.stats(),
+        "geofences": geofences.stats(),
+        "viewports": viewports.stats(),
+    }
+
 
 @router.get("/nearbyUsers")
 async def get_nearby_users(
     token: str,
     session: AsyncSession = Depends(db_helper.session_dependency),
-    max_distance: float = 5000,  # Максимальное расстояние в метрах
+    # Максимальное расстояние в метрах
+    max_distance: float = Query(
+        default=settings.nearby_users.default_radius,
+        gt=0,
+        le=settings.nearby_users.max_radius,
+    ),
+    limit: int = Query(
+        default=settings.nearby_users.default_limit,
+        ge=1,
+        le=settings.nearby_users.max_limit,
+    ),
 ):
     return await crud.get_nearby_users(
         token=token,
         session=session,
         max_distance=max_distance,
+        limit=limit,
+    )
+
+
+@router.get("/trajectory")
+async def get_trajectory(
+    token: str,
+    start: datetime,
+    end: datetime,
+    user_id: int | None = None,
+    tolerance: float = Query(default=10.0, ge=0),  # Допуск упрощения в метрах
+    current_user_id: int = Depends(get_current_user_id),
+    users_client: UsersServiceClient = Depends(get_users_service),
+    session: AsyncSession = Depends(db_helper.session_dependency),
+):
+    # Свой трек виден всегда, чужой — только друзьям
+    if user_id is None:
+        user_id = current_user_id
+    elif user_id != current_user_id:
+        try:
+            friend_ids = await crud.get_friend_list(
+                token=token, users_client=users_client, user_id=current_user_id
+            )
+        except UsersServiceUnavailable as e:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e)
+            )
+        if user_id not in friend_ids:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Trajectory is available only for friends",
+            )
+    return await crud.get_trajectory(
+        session=session,
+        user_id=user_id,
+        start=start,
+        end=end,
+        tolerance=tolerance,
     )
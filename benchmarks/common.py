@@ -0,0 +1,73 @@
+import json
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+import jwt
+
+from core.config import settings
+
+
+def make_token(user_id: int, ttl: float = 3600.0) -> str:
+    return jwt.encode(
+        {"sub": str(user_id), "exp": int(time.time() + ttl)},
+        settings.auth_jwt.secret_key,
+        algorithm=settings.auth_jwt.algorithm,
+    )
+
+
+def percentiles(samples: list[float], points=(50, 90, 95, 99)) -> dict:
+    """Перцентили (nearest-rank) и среднее в миллисекундах."""
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+    result = {
+        "count": len(ordered),
+        "mean_ms": sum(ordered) / len(ordered) * 1000,
+        "max_ms": ordered[-1] * 1000,
+    }
+    for point in points:
+        index = max(0, min(len(ordered) - 1, round(point / 100 * len(ordered)) - 1))
+        result[f"p{point}_ms"] = ordered[index] * 1000
+    return result
+
+
+def parse_metrics(text: str) -> dict[str, float]:
+    """Суммирует сэмплы текстового формата Prometheus по имени (без меток)."""
+    totals: dict[str, float] = {}
+    for line in text.splitlines():
+        if not line or line.startswith("#"):
+            continue
+        sample, _, value = line.rpartition(" ")
+        name = sample.split("{", 1)[0]
+        totals[name] = totals.get(name, 0.0) + float(value)
+    return totals
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_results(name: str, config: dict, results: dict, output: str | None) -> None:
+    """Печатает результаты одним JSON-документом; с --output ещё и в файл."""
+    document = {
+        "benchmark": name,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "git_commit": git_commit(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "config": config,
+        "results": results,
+    }
+    text = json.dumps(document, indent=2, default=str)
+    print(text)
+    if output:
+        with open(output, "w") as f:
+            f.write(text + "\n")
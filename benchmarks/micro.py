@@ -0,0 +1,250 @@
+"""Микробенчмарки горячих функций: events_in_area, get_nearby_users
+(через пространственный индекс в памяти и через KNN-запрос к БД)
+и UserGeo.to_dict.
+
+Данные засеваются в отдельный диапазон id и удаляются после прогона
+(события — с отметками об удалении, чтобы их убрали и запущенные воркеры).
+Если в диапазоне уже есть строки, прогон не начинается. Нужен DATABASE_URL
+с PostGIS:
+
+    DATABASE_URL=postgresql+asyncpg://... \\
+        python -m benchmarks.micro --users 100000 --events 50000
+"""
+import argparse
+import asyncio
+import random
+import time
+from datetime import datetime
+
+from geoalchemy2.shape import from_shape
+from shapely.geometry import Point
+from sqlalchemy import delete, func, insert, select
+
+from api_v1.events.crud import event_location, events_in_area
+from api_v1.events.schemas import EventsInArea
+from api_v1.usersGeo.crud import bulk_upsert_users_geo, get_nearby_users
+from api_v1.usersGeo.spatialIndex import users_geo_index
+from benchmarks.common import make_token, percentiles, write_results
+from core.models import Base, Event, EventTombstone, UserGeo, db_helper
+
+BENCHMARKS = ("to_dict", "events_in_area", "nearby_index", "nearby_db")
+
+# Засеянные события помечаются этим автором, чтобы их можно было удалить
+BENCH_CREATOR = -1
+
+# Область засева: примерно Москва в пределах МКАД
+MIN_LATITUDE, MAX_LATITUDE = 55.55, 55.95
+MIN_LONGITUDE, MAX_LONGITUDE = 37.35, 37.85
+
+
+def random_point() -> tuple[float, float]:
+    return (
+        random.uniform(MIN_LATITUDE, MAX_LATITUDE),
+        random.uniform(MIN_LONGITUDE, MAX_LONGITUDE),
+    )
+
+
+async def measure(call, iterations: int, warmup: int) -> dict:
+    for _ in range(warmup):
+        await call()
+    timings = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        call_started = time.perf_counter()
+        await call()
+        timings.append(time.perf_counter() - call_started)
+    elapsed = time.perf_counter() - started
+    return {"ops_per_second": iterations / elapsed, **percentiles(timings)}
+
+
+async def bench_to_dict(args) -> dict:
+    rows = []
+    for user_id in range(args.first_user_id, args.first_user_id + 1000):
+        latitude, longitude = random_point()
+        rows.append(
+            UserGeo(
+                user_id=user_id,
+                updated_at=datetime.now(),
+                location=from_shape(Point(longitude, latitude), srid=4326),
+            )
+        )
+
+    async def call():
+        for row in rows:
+            row.to_dict()
+
+    result = await measure(call, max(1, args.iterations // 100), args.warmup)
+    # Одна итерация — 1000 строк
+    result["rows_per_second"] = result["ops_per_second"] * len(rows)
+    return result
+
+
+async def seed_events(count: int) -> None:
+    now = datetime.now()
+    values = []
+    for i in range(count):
+        latitude, longitude = random_point()
+        values.append(
+            {
+                "name": f"bench {i}",
+                "description": "",
+                "latitude": latitude,
+                "longitude": longitude,
+                "location": event_location(latitude, longitude),
+                "created_by": BENCH_CREATOR,
+                "created_at": now,
+                "updated_at": now,
+            }
+        )
+    async with db_helper.session_factory() as session:
+        for start in range(0, len(values), 10000):
+            await session.execute(insert(Event), values[start : start + 10000])
+        await session.commit()
+
+
+async def bench_events_in_area(args) -> dict:
+    async def call():
+        # Окно размером примерно с экран телефона на 14-м зуме
+        latitude, longitude = random_point()
+        area = EventsInArea(
+            min_latitude=latitude - 0.01,
+            max_latitude=latitude + 0.01,
+            min_longitude=longitude - 0.02,
+            max_longitude=longitude + 0.02,
+        )
+        async with db_helper.session_factory() as session:
+            await events_in_area(session=session, area=area)
+
+    return await measure(call, args.iterations, args.warmup)
+
+
+async def seed_users(args) -> None:
+    now = datetime.now().timestamp()
+    items = []
+    for user_id in range(args.first_user_id, args.first_user_id + args.users):
+        latitude, longitude = random_point()
+        items.append(
+            {
+                "user_id": user_id,
+                "latitude": latitude,
+                "longitude": longitude,
+                "timestamp": now,
+            }
+        )
+    async with db_helper.session_factory() as session:
+        await bulk_upsert_users_geo(session=session, items=items)
+        await session.commit()
+
+
+async def bench_nearby(args, from_index: bool) -> dict:
+    user_ids = list(range(args.first_user_id, args.first_user_id + args.users))
+    tokens = {user_id: make_token(user_id) for user_id in user_ids[:1000]}
+
+    async def call():
+        user_id = random.choice(user_ids[:1000])
+        if not from_index:
+            # Без точки в индексе get_nearby_users идёт в БД
+            users_geo_index.remove(user_id)
+        async with db_helper.session_factory() as session:
+            await get_nearby_users(token=tokens[user_id], session=session)
+
+    return await measure(call, args.iterations, args.warmup)
+
+
+def seeded_users(args):
+    return UserGeo.user_id.between(
+        args.first_user_id, args.first_user_id + args.users - 1
+    )
+
+
+async def seed_range_conflict(args) -> str | None:
+    # На общей базе иначе перезапишем и затем удалим чужие строки
+    async with db_helper.session_factory() as session:
+        events = await session.scalar(
+            select(func.count())
+            .select_from(Event)
+            .where(Event.created_by == BENCH_CREATOR)
+        )
+        users = await session.scalar(
+            select(func.count()).select_from(UserGeo).where(seeded_users(args))
+        )
+    if events:
+        return f"{events} events with created_by={BENCH_CREATOR} already exist"
+    if users:
+        return (
+            f"{users} UsersGeo rows already exist in the seed range starting at "
+            f"{args.first_user_id}; pass another --first-user-id"
+        )
+    return None
+
+
+async def cleanup(args) -> None:
+    async with db_helper.session_factory() as session:
+        result = await session.execute(
+            delete(Event)
+            .where(Event.created_by == BENCH_CREATOR)
+            .returning(Event.id)
+        )
+        event_ids = result.scalars().all()
+        # По отметкам запущенные воркеры уберут события из геозон и областей
+        if event_ids:
+            await session.execute(
+                insert(EventTombstone),
+                [{"event_id": event_id} for event_id in event_ids],
+            )
+        await session.execute(delete(UserGeo).where(seeded_users(args)))
+        await session.commit()
+    for user_id in range(args.first_user_id, args.first_user_id + args.users):
+        users_geo_index.remove(user_id)
+
+
+async def run(args) -> dict:
+    selected = args.only or BENCHMARKS
+    results = {}
+    if "to_dict" in selected:
+        results["user_geo_to_dict"] = await bench_to_dict(args)
+    if set(selected) == {"to_dict"}:
+        return results
+
+    async with db_helper.engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    conflict = await seed_range_conflict(args)
+    if conflict is not None:
+        await db_helper.engine.dispose()
+        raise SystemExit(f"Refusing to seed: {conflict}")
+    try:
+        if "events_in_area" in selected:
+            await seed_events(args.events)
+            results["events_in_area"] = await bench_events_in_area(args)
+        if "nearby_index" in selected or "nearby_db" in selected:
+            await seed_users(args)
+            if "nearby_index" in selected:
+                results["get_nearby_users_index"] = await bench_nearby(args, True)
+            if "nearby_db" in selected:
+                results["get_nearby_users_db"] = await bench_nearby(args, False)
+    finally:
+        await cleanup(args)
+        await db_helper.engine.dispose()
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--only", nargs="+", choices=BENCHMARKS)
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--events", type=int, default=50_000)
+    # Далеко от реальных id, но в пределах int4
+    parser.add_argument("--first-user-id", type=int, default=2_000_000_000)
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--warmup", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    results = asyncio.run(run(args))
+    write_results("micro", vars(args), results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""Заглушка сервиса пользователей для нагрузочных тестов.
+
+Друзья детерминированы: пользователи делятся на группы по group_size
+подряд идущих id, и каждый дружит со всей своей группой.
+
+    python -m benchmarks.users_stub --port 8010 --group-size 10
+"""
+import argparse
+
+import jwt
+import uvicorn
+from fastapi import FastAPI, Header, HTTPException, status
+from pydantic import BaseModel
+
+
+class UsersByIds(BaseModel):
+    ids: list[int]
+
+
+def user_id_from_header(authorization: str | None) -> int:
+    # Подпись проверяет сам геосервис, здесь достаточно прочитать sub
+    try:
+        token = authorization.removeprefix("Bearer ")
+        payload = jwt.decode(token, options={"verify_signature": False})
+        return int(payload["sub"])
+    except Exception:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
+
+
+def create_app(group_size: int) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/api/v1/friends/friendsList")
+    async def friends_list(authorization: str | None = Header(default=None)):
+        user_id = user_id_from_header(authorization)
+        first = user_id // group_size * group_size
+        return [
+            friend_id
+            for friend_id in range(first, first + group_size)
+            if friend_id != user_id
+        ]
+
+    @app.post("/auth/getUsersByIds")
+    async def users_by_ids(
+        body: UsersByIds, authorization: str | None = Header(default=None)
+    ):
+        user_id_from_header(authorization)
+        return [{"id": user_id, "username": f"user{user_id}"} for user_id in body.ids]
+
+    return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8010)
+    parser.add_argument("--group-size", type=int, default=10)
+    args = parser.parse_args()
+    uvicorn.run(
+        create_app(args.group_size),
+        host=args.host,
+        port=args.port,
+        log_level="warning",
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,304 @@
+"""Нагрузочный тест WebSocket-рассылки геопозиций.
+
+Тысячи клиентов подключаются к /userGeo/ws и шлют update_geo; каждый
+клиент дружит со своей группой (см. benchmarks.users_stub). Считаются
+отправленные обновления в секунду, задержка доставки update_friend_geo
+друзьям (от отправки до получения) и число SQL-запросов на обновление
+по счётчикам /metrics.
+
+С --spawn поднимает заглушку сервиса пользователей и само приложение
+(нужен DATABASE_URL с PostGIS), иначе бьёт в уже запущенное на --host/--app-port:
+
+    DATABASE_URL=postgresql+asyncpg://... \\
+        python -m benchmarks.ws_load --spawn --clients 2000 --duration 30
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+
+import httpx
+import websockets
+
+from benchmarks.common import make_token, parse_metrics, percentiles, write_results
+
+
+class LoadStats:
+    def __init__(self, clients: int):
+        self.clients = clients
+        self.connected = 0
+        self.failed = 0
+        self.handshakes_done = asyncio.Event()
+        # (user_id, latitude, longitude) -> время отправки
+        self.sent_at: dict[tuple[int, float, float], float] = {}
+        self.sent = 0
+        self.received = 0
+        self.errors = 0
+        self.latencies: list[float] = []
+        # Окно измерения: учитываются обновления, отправленные внутри него
+        self.window_start = float("inf")
+        self.window_end = float("inf")
+
+    def in_window(self, moment: float) -> bool:
+        return self.window_start <= moment <= self.window_end
+
+    def handshake(self, ok: bool) -> None:
+        if ok:
+            self.connected += 1
+        else:
+            self.failed += 1
+        if self.connected + self.failed == self.clients:
+            self.handshakes_done.set()
+
+    def on_message(self, raw: str) -> None:
+        now = time.perf_counter()
+        message = json.loads(raw)
+        if message.get("action") != "update_friend_geo":
+            if "error" in message:
+                self.errors += 1
+            return
+        geo = message["geo"]
+        sent_at = self.sent_at.get(
+            (message["user_id"], geo["latitude"], geo["longitude"])
+        )
+        if sent_at is not None and self.in_window(sent_at):
+            self.received += 1
+            self.latencies.append(now - sent_at)
+
+
+async def run_client(
+    url: str,
+    user_id: int,
+    stats: LoadStats,
+    interval: float,
+    connected: asyncio.Event,
+    stop: asyncio.Event,
+    handshakes: asyncio.Semaphore,
+) -> None:
+    async with handshakes:
+        try:
+            websocket = await websockets.connect(
+                f"{url}?token={make_token(user_id)}", open_timeout=30
+            )
+        except Exception:
+            stats.handshake(False)
+            return
+    stats.handshake(True)
+
+    async def reader():
+        async for raw in websocket:
+            if isinstance(raw, str):
+                stats.on_message(raw)
+
+    reader_task = asyncio.create_task(reader())
+    await connected.wait()
+    # Случайная фаза, чтобы клиенты не слали обновления синхронно
+    await asyncio.sleep(random.uniform(0, interval))
+    latitude = random.uniform(55.5, 56.0)
+    longitude = random.uniform(37.3, 37.9)
+    try:
+        while not stop.is_set():
+            # ~50 м за шаг: больше порога min_distance по умолчанию
+            latitude = round(latitude + random.uniform(0.0004, 0.0006), 6)
+            longitude = round(longitude + random.uniform(-0.0005, 0.0005), 6)
+            sent_at = time.perf_counter()
+            stats.sent_at[(user_id, latitude, longitude)] = sent_at
+            await websocket.send(
+                json.dumps(
+                    {
+                        "action": "update_geo",
+                        "geo": {"latitude": latitude, "longitude": longitude},
+                    }
+                )
+            )
+            if stats.in_window(sent_at):
+                stats.sent += 1
+            await asyncio.sleep(interval)
+    except websockets.ConnectionClosed:
+        pass
+    finally:
+        reader_task.cancel()
+        await websocket.close()
+
+
+async def scrape_metrics(client: httpx.AsyncClient) -> dict[str, float]:
+    response = await client.get("/metrics")
+    response.raise_for_status()
+    return parse_metrics(response.text)
+
+
+async def wait_ready(base_url: str, timeout: float = 60.0) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        while True:
+            try:
+                if (await client.get("/metrics")).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"{base_url} is not ready after {timeout}s")
+            await asyncio.sleep(0.5)
+
+
+def spawn(args) -> list[subprocess.Popen]:
+    stub_url = f"http://127.0.0.1:{args.stub_port}"
+    env = {**os.environ, "USER_SERVICE_URL": stub_url}
+    stub = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "benchmarks.users_stub",
+            "--port",
+            str(args.stub_port),
+            "--group-size",
+            str(args.group_size),
+        ]
+    )
+    app = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "main:app",
+            "--port",
+            str(args.app_port),
+            "--log-level",
+            "warning",
+        ],
+        env=env,
+    )
+    return [stub, app]
+
+
+def raise_file_limit() -> None:
+    # Каждый клиент держит сокет
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+async def run(args) -> dict:
+    base_url = f"http://{args.host}:{args.app_port}"
+    ws_url = f"ws://{args.host}:{args.app_port}{args.ws_path}"
+    await wait_ready(base_url)
+
+    stats = LoadStats(clients=args.clients)
+    connected = asyncio.Event()
+    stop = asyncio.Event()
+    handshakes = asyncio.Semaphore(args.connect_concurrency)
+    connect_started = time.perf_counter()
+    clients = [
+        asyncio.create_task(
+            run_client(
+                ws_url,
+                args.first_user_id + i,
+                stats,
+                args.interval,
+                connected,
+                stop,
+                handshakes,
+            )
+        )
+        for i in range(args.clients)
+    ]
+    # Ждём, пока все клиенты подключатся (или не смогут)
+    await stats.handshakes_done.wait()
+    connect_time = time.perf_counter() - connect_started
+    connected.set()
+
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        await asyncio.sleep(args.warmup)
+        before = await scrape_metrics(client)
+        stats.window_start = time.perf_counter()
+        await asyncio.sleep(args.duration)
+        stats.window_end = time.perf_counter()
+        elapsed = stats.window_end - stats.window_start
+        # Даём доставиться сообщениям, отправленным в конце окна
+        await asyncio.sleep(1.0)
+        after = await scrape_metrics(client)
+
+    stop.set()
+    await asyncio.gather(*clients, return_exceptions=True)
+
+    def delta(name: str) -> float:
+        return after.get(name, 0.0) - before.get(name, 0.0)
+
+    server_updates = delta("ws_messages_total")
+    fanouts = delta("ws_fanout_recipients_count")
+    queries = delta("db_query_duration_seconds_count")
+    return {
+        "connected_clients": stats.connected,
+        "failed_clients": stats.failed,
+        "connect_seconds": connect_time,
+        "window_seconds": elapsed,
+        "updates_sent": stats.sent,
+        "updates_per_second": stats.sent / elapsed,
+        # Обновления, прошедшие подавление и разосланные друзьям
+        "updates_fanned_out": fanouts,
+        "fanout_messages_received": stats.received,
+        "fanout_messages_per_second": stats.received / elapsed,
+        "fanout_latency": percentiles(stats.latencies),
+        "server_fanout_mean_recipients": (
+            delta("ws_fanout_recipients_sum") / fanouts if fanouts else None
+        ),
+        "server_fanout_mean_ms": (
+            delta("ws_fanout_duration_seconds_sum") / fanouts * 1000
+            if fanouts
+            else None
+        ),
+        "db_queries": queries,
+        "db_queries_per_update": queries / server_updates if server_updates else None,
+        "db_queries_per_fanned_out_update": queries / fanouts if fanouts else None,
+        "db_pool_checkout_wait_mean_ms": (
+            delta("db_pool_checkout_wait_seconds_sum")
+            / delta("db_pool_checkout_wait_seconds_count")
+            * 1000
+            if delta("db_pool_checkout_wait_seconds_count")
+            else None
+        ),
+        "users_service_calls": delta("users_service_request_duration_seconds_count"),
+        "errors_received": stats.errors,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--app-port", type=int, default=8001)
+    parser.add_argument("--ws-path", default="/api/v1/userGeo/ws")
+    parser.add_argument("--spawn", action="store_true")
+    parser.add_argument("--stub-port", type=int, default=8010)
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--group-size", type=int, default=10)
+    # Далеко от реальных id, но в пределах int4
+    parser.add_argument("--first-user-id", type=int, default=2_100_000_000)
+    # Интервал чуть больше min_interval_ms по умолчанию, чтобы точки не отбрасывались
+    parser.add_argument("--interval", type=float, default=1.1)
+    parser.add_argument("--warmup", type=float, default=3.0)
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--connect-concurrency", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    raise_file_limit()
+    processes = spawn(args) if args.spawn else []
+    try:
+        results = asyncio.run(run(args))
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+    write_results("ws_load", vars(args), results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Ограниченный по размеру кэш с временем жизни записей и вытеснением LRU."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        item = self._data.get(key)
+        if item is not None:
+            expires_at, value = item
+            if expires_at > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._data[key]
+        self.misses += 1
+        return default
+
+    def set(self, key: Hashable, value: Any) -> None:
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key: Hashable) -> bool:
+        return self._data.pop(key, None) is not None
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+class AsyncTTLCache(TTLCache):
+    """TTLCache с асинхронной загрузкой: одновременные промахи по одному ключу
+    ждут один общий запрос (single-flight)."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        super().__init__(maxsize=maxsize, ttl=ttl)
+        self._inflight: dict[Hashable, asyncio.Task] = {}
+        self.coalesced = 0
+
+    async def get_or_load(
+        self,
+        key: Hashable,
+        loader: Callable[[], Awaitable[Any]],
+    ) -> Any:
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            task = asyncio.ensure_future(loader())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._loaded(key, done))
+        # shield: отмена одного из ожидающих не отменяет загрузку для остальных
+        return await asyncio.shield(task)
+
+    def _loaded(self, key: Hashable, task: asyncio.Task) -> None:
+        failed = task.cancelled() or task.exception() is not None
+        # Если ключ инвалидировали во время загрузки, результат уже устарел
+        if self._inflight.get(key) is not task:
+            return
+        del self._inflight[key]
+        if not failed:
+            self.set(key, task.result())
+
+    def invalidate(self, key: Hashable) -> bool:
+        inflight = self._inflight.pop(key, None) is not None
+        return super().invalidate(key) or inflight
+
+    def clear(self) -> None:
+        self._inflight.clear()
+        super().clear()
+
+    def stats(self) -> dict:
+        return {**super().stats(), "coalesced": self.coalesced}
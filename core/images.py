@@ -0,0 +1,37 @@
+import os
+from pathlib import Path
+
+from PIL import Image, ImageOps
+
+
+def variant_filename(filename: str, variant: str) -> str:
+    return f"{Path(filename).stem}_{variant}.webp"
+
+
+def render_variants(
+    source: str,
+    variants: dict[str, int],
+    quality: int,
+) -> dict[str, str]:
+    """Декодирует изображение один раз и сохраняет уменьшенные копии в WebP
+    рядом с исходником. variants: имя -> максимальная сторона в пикселях.
+
+    Выполняется в процессе пула, поэтому модуль не импортирует приложение.
+    """
+    source_path = Path(source)
+    rendered = {}
+    with Image.open(source_path) as image:
+        image = ImageOps.exif_transpose(image)
+        has_alpha = "A" in image.getbands() or "transparency" in image.info
+        image = image.convert("RGBA" if has_alpha else "RGB")
+        # От большего к меньшему: каждый вариант уменьшается из предыдущего
+        for variant, max_side in sorted(
+            variants.items(), key=lambda item: item[1], reverse=True
+        ):
+            image.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+            target = source_path.with_name(variant_filename(source_path.name, variant))
+            temp = target.with_name(f".{target.name}.part")
+            image.save(temp, "WEBP", quality=quality, method=4)
+            os.replace(temp, target)
+            rendered[variant] = target.name
+    return rendered
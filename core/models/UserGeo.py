@@ -2,7 +2,7 @@ from datetime import datetime
 
 from geoalchemy2 import Geometry
 from geoalchemy2.shape import to_shape
-from sqlalchemy import DECIMAL, DateTime, Integer
+from sqlalchemy import DECIMAL, DateTime, Index, Integer, text
 from sqlalchemy.orm import Mapped, mapped_column
 
 from core.models import Base
@@ -10,7 +10,15 @@ from core.models import Base
 
 class UserGeo(Base):
     __tablename__ = "UsersGeo"
-    user_id: Mapped[int] = mapped_column(Integer)
+    __table_args__ = (
+        # Поиск соседей в метрах (ST_DWithin и <-> по geography) идёт по этому индексу
+        Index(
+            "idx_UsersGeo_location_geography",
+            text("(location::geography)"),
+            postgresql_using="gist",
+        ),
+    )
+    user_id: Mapped[int] = mapped_column(Integer, unique=True, index=True)
     updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now)
     location: Mapped[str] = mapped_column(Geometry(geometry_type='POINT', srid=4326))
 
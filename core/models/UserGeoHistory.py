@@ -0,0 +1,36 @@
+from datetime import datetime
+
+from geoalchemy2 import Geometry
+from sqlalchemy import BigInteger, Computed, DateTime, Float, Index, Integer
+from sqlalchemy.orm import Mapped, mapped_column
+
+from core.models import Base
+
+
+class UserGeoHistory(Base):
+    """Журнал геопозиций, секционированный по дням (RANGE по recorded_at).
+    Секции создаёт и удаляет по сроку хранения crud.maintain_history_partitions."""
+
+    __tablename__ = "UsersGeoHistory"
+    __table_args__ = (
+        Index("ix_UsersGeoHistory_user_id_recorded_at", "user_id", "recorded_at"),
+        Index(
+            "ix_UsersGeoHistory_recorded_at_brin",
+            "recorded_at",
+            postgresql_using="brin",
+        ),
+        Index("idx_UsersGeoHistory_location", "location", postgresql_using="gist"),
+        {"postgresql_partition_by": "RANGE (recorded_at)"},
+    )
+
+    # Ключ секционирования обязан входить в первичный ключ
+    id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True)
+    recorded_at: Mapped[datetime] = mapped_column(DateTime, primary_key=True)
+    user_id: Mapped[int] = mapped_column(Integer)
+    latitude: Mapped[float] = mapped_column(Float)
+    longitude: Mapped[float] = mapped_column(Float)
+    # Вычисляется в БД, поэтому пишущий COPY передаёт только широту и долготу
+    location: Mapped[str] = mapped_column(
+        Geometry(geometry_type="POINT", srid=4326, spatial_index=False),
+        Computed("ST_SetSRID(ST_MakePoint(longitude, latitude), 4326)", persisted=True),
+    )
@@ -1,6 +1,18 @@
 from .base import Base
 from .event import Event
+from .event_participant import EventParticipant
+from .event_tombstone import EventTombstone
 from .db_helper import db_helper, DbHelper
 from .UserGeo import UserGeo
+from .UserGeoHistory import UserGeoHistory
 
-__all__ = ("Base", "Event", "db_helper", "DbHelper", "UserGeo")
+__all__ = (
+    "Base",
+    "Event",
+    "EventParticipant",
+    "EventTombstone",
+    "db_helper",
+    "DbHelper",
+    "UserGeo",
+    "UserGeoHistory",
+)
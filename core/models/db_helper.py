@@ -1,6 +1,9 @@
 import os
+import time
 
 from dotenv import load_dotenv
+from sqlalchemy import event
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from sqlalchemy.ext.asyncio import (
     create_async_engine,
     async_sessionmaker,
@@ -10,13 +13,54 @@ from sqlalchemy.ext.asyncio import (
 from asyncio import current_task
 
 from core.config import settings
+from core.metrics import db_pool_checkout_wait, db_query_duration
 
 
 load_dotenv()
 
+SQL_OPERATIONS = {"SELECT", "INSERT", "UPDATE", "DELETE", "WITH"}
+
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    """Пул, замеряющий ожидание свободного соединения: у событий пула
+    нет хука на начало checkout, поэтому оборачиваем получение из очереди."""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            db_pool_checkout_wait.observe(time.perf_counter() - started)
+
+
+# Запросы на одном соединении идут последовательно, так что хватает одной
+# отметки; после ошибки она просто перезапишется следующим запросом
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info["query_started"] = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.pop("query_started", None)
+    if started is None:
+        return
+    operation = statement.lstrip().split(None, 1)[0].upper() if statement else ""
+    db_query_duration.observe(
+        time.perf_counter() - started,
+        operation if operation in SQL_OPERATIONS else "OTHER",
+    )
+
+
 class DbHelper:
     def __init__(self, url: str, echo: bool = False):
-        self.engine = create_async_engine(url=url, echo=echo)
+        self.engine = create_async_engine(
+            url=url, echo=echo, poolclass=InstrumentedPool
+        )
+        event.listen(
+            self.engine.sync_engine, "before_cursor_execute", _before_cursor_execute
+        )
+        event.listen(
+            self.engine.sync_engine, "after_cursor_execute", _after_cursor_execute
+        )
         self.session_factory = async_sessionmaker(
             bind=self.engine,
             expire_on_commit=False,
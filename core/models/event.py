@@ -1,7 +1,8 @@
 from datetime import datetime
 from typing import Optional
 
-from sqlalchemy import DECIMAL, JSON, Integer, String, DateTime, Text
+from geoalchemy2 import Geometry
+from sqlalchemy import DECIMAL, Integer, String, DateTime, Text
 from sqlalchemy.orm import Mapped, mapped_column
 
 from .base import Base
@@ -14,8 +15,20 @@ class Event(Base):
     description: Mapped[str] = mapped_column(Text)
     latitude: Mapped[float] = mapped_column(DECIMAL(17, 14))
     longitude: Mapped[float] = mapped_column(DECIMAL(17, 14))
+    # Дублирует latitude/longitude для индексных запросов по области (GIST)
+    location: Mapped[Optional[str]] = mapped_column(
+        Geometry(geometry_type="POINT", srid=4326, spatial_index=True),
+        nullable=True,
+        deferred=True,
+    )
     preview_picture: Mapped[Optional[str]] = mapped_column(String(100), nullable=True)
-    participants: Mapped[Optional[dict]] = mapped_column(JSON, nullable=True)
+    # Участники лежат в event_participants, здесь только счётчик
+    participants_count: Mapped[int] = mapped_column(
+        Integer, default=0, server_default="0"
+    )
     created_by: Mapped[int] = mapped_column(Integer)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now)
-    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now)
+    # Индекс для инкрементальной сверки изменений (updated_at > последней метки)
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime, default=datetime.now, index=True
+    )
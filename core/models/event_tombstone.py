@@ -0,0 +1,17 @@
+from datetime import datetime
+
+from sqlalchemy import DateTime, Index, Integer
+from sqlalchemy.orm import Mapped, mapped_column
+
+from .base import Base
+
+
+class EventTombstone(Base):
+    """Отметка об удалении события: по ней другие воркеры узнают об удалении,
+    не сверяя весь список id. Старые отметки периодически удаляются."""
+
+    __tablename__ = "event_tombstones"
+    __table_args__ = (Index("ix_event_tombstones_deleted_at", "deleted_at"),)
+
+    event_id: Mapped[int] = mapped_column(Integer)
+    deleted_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now)
@@ -0,0 +1,150 @@
+import asyncio
+import logging
+
+from core.cache import TTLCache
+from core.config import settings
+from core.users_service import UsersServiceClient, UsersServiceUnavailable
+
+logger = logging.getLogger(__name__)
+
+
+class ProfileResolver:
+    """Профили пользователей по id через /auth/getUsersByIds.
+
+    Профили кэшируются по одному; промахи, пришедшие за batch_window с
+    одним токеном, собираются в один вызов сервиса от имени его владельца.
+    Если сервис не ответил за timeout или недоступен, вместо профиля
+    возвращается сам id. Токен вызывающего должен быть проверен заранее.
+    """
+
+    def __init__(
+        self,
+        maxsize: int,
+        ttl: float,
+        batch_window: float,
+        max_batch_size: int,
+        timeout: float,
+    ):
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        self.timeout = timeout
+        # Ожидающие и уже запрошенные (token, id): повторный промах с тем же
+        # токеном ждёт тот же Future. Пачки не смешивают токены разных запросов
+        self._pending: dict[tuple[str, int], asyncio.Future] = {}
+        self._queues: dict[str, list[int]] = {}
+        self._flush_handles: dict[str, asyncio.TimerHandle] = {}
+        self._tasks: set[asyncio.Task] = set()
+        self.batches = 0
+        self.degraded = 0
+
+    async def resolve(
+        self,
+        user_ids: list[int],
+        token: str,
+        users_client: UsersServiceClient,
+    ) -> list[dict | int]:
+        profiles: dict[int, dict] = {}
+        waiting: dict[int, asyncio.Future] = {}
+        for user_id in user_ids:
+            profile = self.cache.get(user_id)
+            if profile is not None:
+                profiles[user_id] = profile
+            elif user_id not in waiting:
+                waiting[user_id] = self._request(user_id, token, users_client)
+
+        if waiting:
+            # Futures общие для запросов с этим токеном, поэтому по таймауту
+            # их не отменяем: пачка догрузится в кэш для следующих обращений
+            await asyncio.wait(waiting.values(), timeout=self.timeout)
+            for user_id, future in waiting.items():
+                if future.done() and future.result() is not None:
+                    profiles[user_id] = future.result()
+            if len(profiles) < len(set(user_ids)):
+                self.degraded += 1
+        return [profiles.get(user_id, user_id) for user_id in user_ids]
+
+    def _request(
+        self,
+        user_id: int,
+        token: str,
+        users_client: UsersServiceClient,
+    ) -> asyncio.Future:
+        future = self._pending.get((token, user_id))
+        if future is not None:
+            return future
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending[(token, user_id)] = future
+        queue = self._queues.setdefault(token, [])
+        queue.append(user_id)
+        if len(queue) >= self.max_batch_size:
+            self._flush(token, users_client)
+        elif token not in self._flush_handles:
+            self._flush_handles[token] = loop.call_later(
+                self.batch_window, self._flush, token, users_client
+            )
+        return future
+
+    def _flush(self, token: str, users_client: UsersServiceClient) -> None:
+        handle = self._flush_handles.pop(token, None)
+        if handle is not None:
+            handle.cancel()
+        batch = self._queues.pop(token, [])
+        if not batch:
+            return
+        self.batches += 1
+        task = asyncio.create_task(self._fetch(batch, token, users_client))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _fetch(
+        self,
+        batch: list[int],
+        token: str,
+        users_client: UsersServiceClient,
+    ) -> None:
+        found: dict[int, dict] = {}
+        try:
+            response = await users_client.post(
+                "/auth/getUsersByIds",
+                headers={"Authorization": f"Bearer {token}"},
+                json={"ids": batch},
+            )
+            if response.status_code == 200:
+                for profile in response.json():
+                    found[profile["id"]] = profile
+            else:
+                logger.warning(
+                    "getUsersByIds returned %s for %d ids",
+                    response.status_code,
+                    len(batch),
+                )
+        except UsersServiceUnavailable as e:
+            logger.warning("Users service unavailable: %s", e)
+        except Exception:
+            logger.exception("Failed to fetch user profiles")
+        finally:
+            for user_id in batch:
+                profile = found.get(user_id)
+                if profile is not None:
+                    self.cache.set(user_id, profile)
+                future = self._pending.pop((token, user_id), None)
+                if future is not None and not future.done():
+                    future.set_result(profile)
+
+    def stats(self) -> dict:
+        return {
+            **self.cache.stats(),
+            "batches": self.batches,
+            "degraded": self.degraded,
+        }
+
+
+profile_resolver = ProfileResolver(
+    maxsize=settings.profiles.maxsize,
+    ttl=settings.profiles.ttl,
+    batch_window=settings.profiles.batch_window,
+    max_batch_size=settings.profiles.max_batch_size,
+    timeout=settings.profiles.timeout,
+)
@@ -0,0 +1,149 @@
+import asyncio
+import logging
+import time
+
+import httpx
+
+from core.config import settings
+from core.metrics import users_service_circuit_open, users_service_duration
+
+logger = logging.getLogger(__name__)
+
+
+class UsersServiceUnavailable(Exception):
+    pass
+
+
+class CircuitOpenError(UsersServiceUnavailable):
+    pass
+
+
+class CircuitBreaker:
+    """После failure_threshold ошибок подряд перестаёт пропускать запросы на
+    reset_timeout секунд, затем пропускает один пробный запрос."""
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: float | None = None
+        self._probe_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.reset_timeout:
+            return "open"
+        return "half_open"
+
+    def before_call(self) -> None:
+        state = self.state
+        if state == "open" or (state == "half_open" and self._probe_in_flight):
+            raise CircuitOpenError("Users service circuit is open")
+        if state == "half_open":
+            self._probe_in_flight = True
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self._probe_in_flight = False
+
+    def release_probe(self) -> None:
+        # Пробный запрос прерван не по вине сервиса: пропускаем следующий
+        self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self._probe_in_flight or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+        self._probe_in_flight = False
+
+
+class UsersServiceClient:
+    """Общий на приложение HTTP-клиент сервиса пользователей с пулом соединений."""
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url
+        self.config = settings.users_service
+        self.breaker = CircuitBreaker(
+            failure_threshold=self.config.failure_threshold,
+            reset_timeout=self.config.reset_timeout,
+        )
+        self.client: httpx.AsyncClient | None = None
+
+    def start(self) -> None:
+        if self.client is not None:
+            return
+        http2 = self.config.http2
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                logger.warning("HTTP/2 requires httpx[http2], falling back to HTTP/1.1")
+                http2 = False
+        self.client = httpx.AsyncClient(
+            base_url=self.base_url,
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=self.config.max_connections,
+                max_keepalive_connections=self.config.max_keepalive_connections,
+                keepalive_expiry=self.config.keepalive_expiry,
+            ),
+            timeout=httpx.Timeout(
+                connect=self.config.connect_timeout,
+                read=self.config.read_timeout,
+                write=self.config.read_timeout,
+                pool=self.config.pool_timeout,
+            ),
+        )
+
+    async def close(self) -> None:
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    async def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        if self.client is None:
+            self.start()
+        try:
+            self.breaker.before_call()
+        except CircuitOpenError:
+            users_service_circuit_open.inc(method, url)
+            raise
+        started = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, **kwargs)
+        except httpx.TransportError as e:
+            users_service_duration.observe(
+                time.perf_counter() - started, method, url, "error"
+            )
+            self.breaker.record_failure()
+            raise UsersServiceUnavailable(f"Users service request failed: {e!r}") from e
+        except asyncio.CancelledError:
+            self.breaker.release_probe()
+            raise
+        except BaseException:
+            self.breaker.record_failure()
+            raise
+        users_service_duration.observe(
+            time.perf_counter() - started, method, url, response.status_code
+        )
+        if response.status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return response
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("POST", url, **kwargs)
+
+
+users_service = UsersServiceClient(base_url=settings.user_service_url)
+
+
+def get_users_service() -> UsersServiceClient:
+    return users_service
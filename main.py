@@ -1,21 +1,75 @@
+import asyncio
+import logging
 from contextlib import asynccontextmanager
 from core.models import Base, db_helper
 from api_v1 import router as apiv1_router
+from api_v1.usersGeo.crud import (
+    sync_users_geo_index,
+    run_users_geo_index_sync,
+    maintain_history_partitions,
+    run_history_maintenance,
+)
+from api_v1.usersGeo.geoWriter import geo_writer, history_writer
+from api_v1.events.crud import sync_event_changes, run_event_changes_sync
+from api_v1.events.previews import preview_pipeline
+from api_v1.usersGeo.geolocationWebSocket.geoWS import manager
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 import uvicorn
 from core.config import settings
+from core.metrics import MetricsMiddleware, registry
+from core.users_service import users_service
+
+logging.basicConfig(
+    level=settings.log_level.upper(),
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     async with db_helper.engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+    async with db_helper.session_factory() as session:
+        geo_index_synced_at = await sync_users_geo_index(session=session)
+        if settings.history.enabled:
+            await maintain_history_partitions(session=session)
+        event_changes_synced_at = await sync_event_changes(session=session)
+    background_tasks = [
+        asyncio.create_task(run_users_geo_index_sync(since=geo_index_synced_at)),
+    ]
+    if settings.history.enabled:
+        background_tasks.append(asyncio.create_task(run_history_maintenance()))
+    background_tasks.append(
+        asyncio.create_task(run_event_changes_sync(since=event_changes_synced_at))
+    )
+    geo_writer.start()
+    history_writer.start()
+    users_service.start()
+    preview_pipeline.start()
+    await manager.start()
     yield
+    await manager.stop()
+    for task in background_tasks:
+        task.cancel()
+    await users_service.close()
+    await preview_pipeline.stop()
+    # Сохраняем накопленные геопозиции перед остановкой
+    await geo_writer.stop()
+    await history_writer.stop()
 
 
 app = FastAPI(lifespan=lifespan)
+app.add_middleware(MetricsMiddleware)
 app.include_router(router=apiv1_router, prefix=settings.api_v1_prefix)
 
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return PlainTextResponse(
+        registry.render(), media_type="text/plain; version=0.0.4"
+    )
+
 if __name__ == "__main__":
     import uvicorn
 
@@ -0,0 +1,30 @@
+import asyncio
+
+from api_v1.usersGeo.geolocationWebSocket.broker import InProcessBroker, InProcessHub
+from api_v1.usersGeo.geolocationWebSocket.connectionManager import ConnectionManager
+
+
+def test_broadcast_reaches_other_nodes_only():
+    async def scenario():
+        hub = InProcessHub()
+        managers = [
+            ConnectionManager(broker=InProcessBroker(node_id=node_id, hub=hub))
+            for node_id in ("a", "b", "c")
+        ]
+        received = {manager.broker.node_id: [] for manager in managers}
+        for manager in managers:
+            manager.broadcast_handlers["ping"] = received[manager.broker.node_id].append
+            await manager.start()
+        await managers[0].broadcast({"type": "ping", "user_ids": [1]})
+        # Неизвестный тип не ломает узел-получатель
+        await managers[0].broadcast({"type": "unknown"})
+        for manager in managers:
+            await manager.stop()
+        return received
+
+    received = asyncio.run(scenario())
+    assert received == {
+        "a": [],
+        "b": [{"type": "ping", "user_ids": [1]}],
+        "c": [{"type": "ping", "user_ids": [1]}],
+    }
@@ -0,0 +1,55 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from api_v1.usersGeo.crud import INT4_MAX, bulk_upsert_users_geo, parse_bulk_point
+from core.config import settings
+
+
+def item(**overrides) -> dict:
+    return {
+        "user_id": 1,
+        "latitude": 55.75,
+        "longitude": 37.61,
+        "timestamp": datetime.now().timestamp(),
+        **overrides,
+    }
+
+
+def test_parses_epoch_and_iso_timestamps():
+    moment = datetime(2024, 5, 1, 12, 30)
+    assert parse_bulk_point(item(timestamp=moment.timestamp()))["updated_at"] == moment
+    assert parse_bulk_point(item(timestamp=moment.isoformat()))["updated_at"] == moment
+
+
+@pytest.mark.parametrize("user_id", [0, -1, INT4_MAX + 1, True, "1"])
+def test_rejects_bad_user_id(user_id):
+    with pytest.raises(ValueError):
+        parse_bulk_point(item(user_id=user_id))
+
+
+def test_accepts_timestamp_within_skew():
+    skew = settings.geo_bulk.max_future_skew
+    ahead = datetime.now() + timedelta(seconds=skew / 2)
+    assert parse_bulk_point(item(timestamp=ahead.isoformat()))["updated_at"] == ahead
+
+
+@pytest.mark.parametrize("as_iso", [False, True])
+def test_rejects_future_timestamp(as_iso):
+    future = datetime.now() + timedelta(seconds=settings.geo_bulk.max_future_skew + 60)
+    timestamp = future.isoformat() if as_iso else future.timestamp()
+    with pytest.raises(ValueError, match="future"):
+        parse_bulk_point(item(timestamp=timestamp))
+
+
+def test_bulk_marks_future_items_invalid():
+    future = datetime.now() + timedelta(days=1)
+    # Все элементы отбракованы, поэтому до БД дело не доходит
+    result = asyncio.run(
+        bulk_upsert_users_geo(session=None, items=[item(timestamp=future.timestamp())])
+    )
+    assert result["invalid"] == 1
+    assert result["items"] == [
+        {"status": "invalid", "error": "timestamp is in the future"}
+    ]
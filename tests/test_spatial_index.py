@@ -0,0 +1,54 @@
+import random
+
+import pytest
+
+from api_v1.usersGeo.spatialIndex import SpatialGridIndex, distance_sphere
+
+
+def filled_index(cell_size: float = 0.05) -> SpatialGridIndex:
+    # Далёкие точки, чтобы индекс обходил ячейки, а не перебирал все точки
+    index = SpatialGridIndex(cell_size=cell_size)
+    for key in range(1000, 1200):
+        index.update(key, 40 + key % 10, key % 20 - 10)
+    return index
+
+
+def brute_force(index, latitude, longitude):
+    found = [
+        (key, distance_sphere(latitude, longitude, lat, lon))
+        for key, (lat, lon) in index.points.items()
+    ]
+    found.sort(key=lambda item: item[1])
+    return found
+
+
+@pytest.mark.parametrize("cell_size", [0.05, 0.07])
+def test_within_crosses_antimeridian(cell_size):
+    index = filled_index(cell_size)
+    index.update(1, 0, 179.999)
+    index.update(2, 0, -179.9995)
+    assert [key for key, _ in index.within(0, -179.999, 1000)] == [2, 1]
+    assert [key for key, _ in index.within(0, 179.9995, 1000)] == [1, 2]
+
+
+@pytest.mark.parametrize("cell_size", [0.05, 0.07])
+def test_nearest_crosses_antimeridian(cell_size):
+    index = filled_index(cell_size)
+    index.update(1, 0, 179.999)
+    index.update(2, 0.2, -179.999)
+    assert [key for key, _ in index.nearest(0, -179.999, 1)] == [1]
+    assert index.nearest(0, -179.999, 2) == brute_force(index, 0, -179.999)[:2]
+
+
+def test_matches_brute_force():
+    random.seed(0)
+    index = SpatialGridIndex(cell_size=0.5)
+    for key in range(2000):
+        index.update(key, random.uniform(-60, 60), random.uniform(-180, 180))
+    for _ in range(50):
+        latitude, longitude = random.uniform(-60, 60), random.uniform(-180, 180)
+        expected = brute_force(index, latitude, longitude)
+        assert index.nearest(latitude, longitude, 5) == expected[:5]
+        assert index.within(latitude, longitude, 200_000) == [
+            item for item in expected if item[1] <= 200_000
+        ]